@@ -1,45 +1,150 @@
 import streamlit as st
 from io import BytesIO
-import zipfile
-from generate import generate
-import base64
+from generate import list_units, validate, parse_workbook
+from functions import ErrorFound
+from cache import XMLCache, WorkbookCache, content_key
+from jobs import JobManager
+from profiling import Profiler
 import datetime
+import os
+import time
+
+# Elmhurst XSD the generated XML can be checked against, supplied by the server
+SCHEMA = os.environ.get('SAP_XSD')
+
+@st.cache_resource
+def unit_cache():
+    """One XML cache shared by every session and rerun of the app"""
+    return XMLCache(max_bytes=256 * 1024 * 1024)
+
+@st.cache_resource
+def job_manager():
+    """One background job queue shared by every session, so jobs survive reruns and dropped connections"""
+    return JobManager(cache=unit_cache())
+
+def parsed_upload(uploaded_file):
+    """Reads the upload from Excel only the first time its content is seen in this session.
+    The read is timed, without memory tracing, as it happens before profiling is chosen"""
+    if 'workbooks' not in st.session_state:
+        st.session_state['workbooks'] = WorkbookCache(max_bytes=128 * 1024 * 1024, ttl=30 * 60)
+    workbooks = st.session_state['workbooks']
+    data = uploaded_file.getvalue()
+    key = content_key(data)
+    workbook = workbooks.get(key)
+    if workbook is None:
+        file = BytesIO(data)
+        file.name = uploaded_file.name
+        workbook = parse_workbook(file, Profiler(memory=False))
+        workbooks.put(key, workbook)
+    return workbook
+
+def show_problems(problems):
+    """Shows the problems found in the Calc Sheet as one table"""
+    st.error(f'Found {len(problems)} problem(s)')
+    st.dataframe(problems, use_container_width=True)
+
+def show_profile(profiler):
+    """Shows the per-stage totals and the per-unit records of the last generation"""
+    with st.expander('Profile of the generation'):
+        st.caption('Time and memory of each stage, summed over the units, with the slowest unit')
+        st.dataframe(profiler.totals(), use_container_width=True)
+        st.caption('Every stage of every unit')
+        st.dataframe(profiler.records, use_container_width=True)
+
+def show_job(job):
+    """Shows the progress of a background job, then its download or its problems"""
+    st.subheader(f'Job {job.id[:8]}: {job.file_name}')
+    st.caption(f'Reopen this page with ?job={job.id} to come back to it')
+    st.progress(job.progress, text=f'{len(job.done)} of {job.total or "?"} unit(s) done')
+    if len(job.workbooks) > 1:
+        st.dataframe(job.workbooks, use_container_width=True)
+    if job.running:
+        # Poll the job by rerunning the script, the work itself carries on in the background
+        time.sleep(1)
+        st.rerun()
+    elif job.status == 'done':
+        timestamp = datetime.datetime.fromtimestamp(job.finished)
+        zip_filename = f"{str(timestamp).split('.')[0].replace(':','-')}_SAP_XMLs.zip"
+        st.download_button(f'Download {zip_filename}', data=job.archive, file_name=zip_filename,
+                           mime='application/zip')
+    if job.problems:
+        show_problems(job.problems)
+    elif job.status == 'failed':
+        st.error(job.error)
+    if job.profiler is not None and not job.running:
+        show_profile(job.profiler)
 
 def main():
     st.title("SAP XML Generator")
     st.header('Download the standard Excel Calc Sheet', divider='rainbow')
     
     standard_calc_sheet = 'CALC-XX-XX-SAP CALC TEMPLATE.xlsx'
-    if st.button('Download Excel File'):
-        with open(standard_calc_sheet, 'rb') as file:
-            file_content = file.read()
-            bin_str = base64.b64encode(file_content).decode()
-        st.markdown(f'<a href="data:application/octet-stream;base64,{bin_str}" download="{standard_calc_sheet}">Download standard Excel Calc Sheet</a>', unsafe_allow_html=True)
+    # Served as raw bytes over HTTP by Streamlit, not pushed through the page as base64
+    with open(standard_calc_sheet, 'rb') as file:
+        st.download_button('Download standard Excel Calc Sheet', data=file, file_name=standard_calc_sheet,
+                           mime='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
     
-    st.header('Generate the XMLs by uploading your completed Calc Sheet below', divider='rainbow')
+    st.header('Generate the XMLs by uploading your completed Calc Sheets below', divider='rainbow')
     
-    # File upload widget
-    uploaded_file = st.file_uploader("Choose a Calc Sheet file", type=["xlsx"])
+    # File upload widget. Several Calc Sheets, e.g. one per block, are processed together
+    uploaded_files = st.file_uploader("Choose one or more Calc Sheet files", type=["xlsx"], accept_multiple_files=True)
+    workers = st.number_input("Worker processes", min_value=1, max_value=os.cpu_count() or 1, value=1,
+                              help="Units of each Calc Sheet generated at once on the shared worker processes")
+    profile = st.checkbox("Profile stages", help="Record the time and memory of each stage for every unit")
+    check_schema = SCHEMA is not None and st.checkbox("Check against the Elmhurst XSD", value=True,
+                                                      help="Report every unit whose XML Elmhurst would reject")
+    thermal_bridges = st.checkbox("Thermal bridge totals",
+                                  help="Add a CSV with the HTB, y-value and heat loss of each junction of every unit")
+
+    # The job in the URL, if any. While it runs the page reruns every second to poll it, and the uploads
+    # are left alone so no rerun reads them from Excel again
+    job_id = st.experimental_get_query_params().get('job', [None])[0]
+    job = job_manager().get(job_id) if job_id is not None else None
+    polling = job is not None and job.running
+
+    workbooks = []
+    if polling and uploaded_files:
+        st.info('The uploads can be validated or generated again once the job has finished')
+    for uploaded_file in [] if polling else uploaded_files:
+        try:
+            workbooks.append(parsed_upload(uploaded_file))
+        except Exception as exc:
+            st.error(f'{uploaded_file.name} could not be read as a Calc Sheet: {exc}')
 
-    if uploaded_file is not None:
-        # Process file and generate XML
+    if workbooks:
+        # Units can only be picked out of a single Calc Sheet
+        selected_units = None
+        if len(workbooks) == 1:
+            selected_units = st.multiselect("Units to generate (leave empty for all)", list_units(workbooks[0])) or None
+        # Check the sheets without generating anything
+        if st.button("Validate only"):
+            problems = []
+            with st.spinner("Validating..."):
+                for workbook in workbooks:
+                    try:
+                        found = validate(workbook, workers=int(workers), units=selected_units,
+                                         pool=job_manager().pool)
+                        problems.extend({'workbook': workbook.name, **problem} for problem in found)
+                    except ErrorFound as exc:
+                        st.error(f'{workbook.name}: {exc}')
+            if problems:
+                show_problems(problems)
+            else:
+                st.success('No problems found')
+
+        # Process the files and generate XML in the background. The job id is kept in the URL
         if st.button("Generate XML"):
-            with st.spinner("Processing..."):
-                names,xml_outputs = generate(uploaded_file)
-
-            # Create a zip file containing all the XML files
-            timestamp = datetime.datetime.now()
-            zip_filename = f"{str(timestamp).split('.')[0].replace(':','-')}_SAP_XMLs.zip"
-            zip_buffer = BytesIO()
-            with zipfile.ZipFile(zip_buffer, 'a', zipfile.ZIP_DEFLATED, False) as zip_file:
-                for i, xml_output in enumerate(xml_outputs):
-                    xml_bytes = xml_output.encode('utf-8')
-                    zip_file.writestr(f'{names[i]}.xml', xml_bytes)
-           
-            st.markdown(
-                f'<a href="data:application/zip;base64,{base64.b64encode(zip_buffer.getvalue()).decode()}" download="{zip_filename}">Download {zip_filename}</a>',
-                unsafe_allow_html=True
-            )
-            
+            job_id = job_manager().submit(workbooks, units=selected_units, workers=int(workers),
+                                          profiler=Profiler() if profile else None,
+                                          schema=SCHEMA if check_schema else None, thermal_bridges=thermal_bridges)
+            st.experimental_set_query_params(job=job_id)
+            job = job_manager().get(job_id)
+
+    if job_id is not None:
+        if job is None:
+            st.warning('This job has expired or is unknown. Please generate the XMLs again')
+        else:
+            show_job(job)
+
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,148 @@
+"""Command line batch mode, converting whole directories of Calc Sheets without the app"""
+
+import argparse
+import glob
+import os
+import shutil
+import sys
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from functions import ErrorFound
+from generate import iter_generate, totals_csv, TOTALS_FILE
+from schema import load_schema
+from validation import format_problems
+
+def find_workbooks(sources):
+    """Expands directories and glob patterns into the sorted list of Calc Sheets to convert"""
+    paths = set()
+    for source in sources:
+        if os.path.isdir(source):
+            matches = glob.glob(os.path.join(source, '*.xlsx'))
+        else:
+            matches = glob.glob(source, recursive=True) or [source]
+        # Skip the lock files Excel leaves next to open workbooks
+        paths.update(os.path.normpath(path) for path in matches if not os.path.basename(path).startswith('~$'))
+    return sorted(paths)
+
+def output_names(paths):
+    """Names each Calc Sheet's output after its path below the folder all of them share, without the extension,
+    so Calc Sheets with the same file name in different folders get outputs of their own"""
+    paths = [os.path.abspath(path) for path in paths]
+    try:
+        root = os.path.commonpath([os.path.dirname(path) for path in paths])
+    except ValueError:
+        # Paths on different drives share no folder, their whole path is kept
+        return [os.path.splitext(os.path.splitdrive(path)[1].lstrip(os.sep))[0] for path in paths]
+    return [os.path.splitext(os.path.relpath(path, root))[0] for path in paths]
+
+def convert_workbook(path, output, as_zip=False, schema=None, thermal_bridges=False, name=None):
+    """Writes every unit of one Calc Sheet to output/<name>/ or output/<name>.zip, name being the file stem by default.
+    The output is written under a .part name and only kept if every unit was generated, and passed the XSD at
+    `schema` if one is given. With thermal_bridges set, the thermal bridge totals are written next to the XMLs.
+    Returns (path, unit names, problems, error)"""
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    target = os.path.join(output, name + ('.zip' if as_zip else ''))
+    # Named after the process too, so no two runs ever stage into the same place
+    staging = f'{target}.{os.getpid()}.part'
+    names = []
+    problems = []
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if as_zip:
+            archive = zipfile.ZipFile(staging, 'w', zipfile.ZIP_DEFLATED)
+            write = archive.writestr
+        else:
+            os.makedirs(staging, exist_ok=True)
+            archive = None
+            def write(file_name, data):
+                with open(os.path.join(staging, file_name), 'wb') as file:
+                    file.write(data)
+        try:
+            totals = [] if thermal_bridges else None
+            for unit, xml, unit_problems in iter_generate(path, schema=schema, totals=totals):
+                problems.extend(unit_problems)
+                if not problems:
+                    write(f'{unit}.xml', xml.encode('utf-8'))
+                    names.append(unit)
+            if totals and not problems:
+                write(TOTALS_FILE, totals_csv(totals).encode('utf-8'))
+        finally:
+            if archive is not None:
+                archive.close()
+        if problems:
+            return path, [], problems, None
+        remove(target)
+        os.replace(staging, target)
+        return path, names, [], None
+    except Exception as exc:
+        return path, [], problems, f'{type(exc).__name__}: {exc}'
+    finally:
+        remove(staging)
+
+def remove(path):
+    """Deletes a file or folder left by a previous run, if there is one"""
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+def run(paths, output, as_zip=False, workers=1, schema=None, thermal_bridges=False):
+    """Yields convert_workbook results in the order of paths, converting `workers` workbooks at a time.
+    The outputs are laid out as the Calc Sheets are, below the folder they share"""
+    os.makedirs(output, exist_ok=True)
+    names = output_names(paths)
+    if workers > 1 and len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+            yield from pool.map(convert_workbook, paths, [output]*len(paths), [as_zip]*len(paths),
+                                [schema]*len(paths), [thermal_bridges]*len(paths), names)
+    else:
+        for path, name in zip(paths, names):
+            yield convert_workbook(path, output, as_zip, schema, thermal_bridges, name)
+
+def main(argv=None):
+    """Converts the Calc Sheets given on the command line and returns the exit status"""
+    parser = argparse.ArgumentParser(description='Generate the Elmhurst SAP XMLs for many Calc Sheets at once')
+    parser.add_argument('sources', nargs='+', help='Calc Sheets, directories of Calc Sheets or glob patterns')
+    parser.add_argument('-o', '--output', default='SAP_XMLs', help='Folder the XMLs are written to')
+    parser.add_argument('--zip', action='store_true', help='Write one ZIP per Calc Sheet instead of a folder')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count() or 1,
+                        help='Number of Calc Sheets converted in parallel')
+    parser.add_argument('--schema', help='Elmhurst XSD to check every XML against, needs lxml')
+    parser.add_argument('--thermal-bridges', action='store_true',
+                        help=f'Write the HTB, y-value and heat loss of each junction per unit to "{TOTALS_FILE}"')
+    args = parser.parse_args(argv)
+
+    schema = None
+    if args.schema:
+        # Loaded here first so a bad schema stops the run before any Calc Sheet is read
+        schema = os.path.abspath(args.schema)
+        try:
+            load_schema(schema)
+        except ErrorFound as exc:
+            print(exc, file=sys.stderr)
+            return 2
+
+    paths = find_workbooks(args.sources)
+    if not paths:
+        print('No Calc Sheets found', file=sys.stderr)
+        return 2
+
+    failed = []
+    units = 0
+    for path, names, problems, error in run(paths, args.output, args.zip, args.workers, schema, args.thermal_bridges):
+        if problems or error:
+            failed.append((path, problems, error))
+        else:
+            units += len(names)
+
+    print(f'Converted {len(paths) - len(failed)} of {len(paths)} Calc Sheet(s), {units} unit(s), into {args.output}')
+    for path, problems, error in failed:
+        print(f'\nFailed: {path}', file=sys.stderr)
+        if problems:
+            print(format_problems(problems), file=sys.stderr)
+        if error:
+            print(f'- {error}', file=sys.stderr)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
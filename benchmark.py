@@ -0,0 +1,88 @@
+"""Times each stage of XML generation on synthetic Calc Sheets, for judging optimisations and sizing servers"""
+
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from generate import read_units, list_units
+from functions import input_reader, match_xml, data_to_xml, prettify, find_and_replace, emit_xml
+from synthetic import build_workbook
+
+def run_stages(path):
+    """Runs every stage over all the units of the Calc Sheet once, yielding (stage, outputs)"""
+    sheets = [sheet for _, sheet in read_units(path)]
+    yield 'load', sheets
+    units = [input_reader(sheet) for sheet in sheets]
+    yield 'input_reader', units
+    outputs = [match_xml(unit) for unit in units]
+    yield 'match_xml', outputs
+    raw = [data_to_xml(output) for output in outputs]
+    yield 'data_to_xml', raw
+    pretty = [prettify(xml) for xml in raw]
+    yield 'prettify', pretty
+    yield 'find_and_replace', [find_and_replace(xml) for xml in pretty]
+    yield 'emit_xml', [emit_xml(output) for output in outputs]
+
+def time_stages(path, repeat=3):
+    """Returns the best wall time of each stage, in seconds, over `repeat` runs"""
+    best = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for stage, _ in run_stages(path):
+            end = time.perf_counter()
+            best[stage] = min(best.get(stage, end - start), end - start)
+            start = time.perf_counter()
+    return best
+
+def peak_memory(path):
+    """Returns how far each stage raised the traced memory above what earlier stages held, in bytes.
+    Run apart from the timings, which tracing slows"""
+    peaks = {}
+    tracemalloc.start()
+    try:
+        held = 0
+        for stage, _ in run_stages(path):
+            current, peak = tracemalloc.get_traced_memory()
+            peaks[stage] = peak - held
+            held = current
+            tracemalloc.reset_peak()
+    finally:
+        tracemalloc.stop()
+    return peaks
+
+def report(units, timings, peaks):
+    """Formats the timings as a table with the throughput of each stage and of both serialisation paths"""
+    lines = [f'{"Stage":<18}{"Total s":>10}{"ms/unit":>10}{"units/s":>10}{"Peak MB":>10}']
+    for stage, seconds in timings.items():
+        lines.append(f'{stage:<18}{seconds:>10.3f}{seconds / units * 1000:>10.2f}'
+                     f'{units / seconds:>10.1f}{peaks[stage] / 2**20:>10.1f}')
+    common = timings['load'] + timings['input_reader'] + timings['match_xml']
+    legacy = common + timings['data_to_xml'] + timings['prettify'] + timings['find_and_replace']
+    current = common + timings['emit_xml']
+    lines.append(f'End to end, legacy serialisation: {units / legacy:.1f} units/s')
+    lines.append(f'End to end, emit_xml: {units / current:.1f} units/s')
+    return '\n'.join(lines)
+
+def main(argv=None):
+    """Builds a synthetic Calc Sheet, or takes an existing one, and prints the stage timings"""
+    parser = argparse.ArgumentParser(description='Benchmark the SAP XML generation stages')
+    parser.add_argument('--workbook', help='Benchmark this Calc Sheet instead of a synthetic one')
+    parser.add_argument('--units', type=int, default=10, help='Unit sheets in the synthetic Calc Sheet')
+    parser.add_argument('--opaque-elements', type=int, default=40, help='Opaque elements per unit')
+    parser.add_argument('--openings', type=int, default=60, help='Openings per unit')
+    parser.add_argument('--tb-lengths', type=int, default=10, help='Lengths entered under each thermal bridge')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per stage, the best one is reported')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as folder:
+        path = args.workbook
+        if path is None:
+            path = build_workbook(os.path.join(folder, 'synthetic.xlsx'), units=args.units,
+                                  opaque_elements=args.opaque_elements, openings=args.openings,
+                                  tb_lengths=args.tb_lengths)
+        units = len(list_units(path))
+        print(report(units, time_stages(path, args.repeat), peak_memory(path)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Content-hash caches of generated unit XML and parsed uploads, so unchanged inputs are not processed again"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from threading import Lock
+import pandas as pd
+from functions import INPUT_COLUMNS, GENERATOR_VERSION
+
+def unit_key(sheet):
+    """Hashes the generator version and the cells input_reader reads from the unit sheet"""
+    relevant = sheet.loc[:, sheet.columns.isin(INPUT_COLUMNS)]
+    digest = hashlib.sha256(GENERATOR_VERSION.encode())
+    digest.update('\x1f'.join(map(str, relevant.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(relevant, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+def content_key(data):
+    """Hashes the bytes of an uploaded file"""
+    return hashlib.sha256(data).hexdigest()
+
+class XMLCache:
+    """Bounded store of unit XML keyed by unit_key, evicting the least recently used units first.
+    With a ttl, entries also expire that many seconds after they were stored"""
+    def __init__(self, max_bytes=64 * 1024 * 1024, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Streamlit sessions run on separate threads and share the same cache
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sizeof(self, xml):
+        """Bytes an entry counts for against max_bytes"""
+        return len(xml.encode('utf-8'))
+
+    def get(self, key):
+        """Returns the cached XML for key, or None, and marks it as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self.size -= self._entries.pop(key)[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, xml):
+        """Stores the XML for key, then evicts the oldest units until the cache fits in max_bytes"""
+        size = self.sizeof(xml)
+        if size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (xml, size, expires)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        """Empties the cache"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+class WorkbookCache(XMLCache):
+    """Bounded store of parsed uploads keyed by content_key, so a Calc Sheet is only read from Excel once"""
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=30 * 60):
+        super().__init__(max_bytes, ttl)
+
+    def sizeof(self, workbook):
+        return sum(int(sheet.memory_usage(deep=True).sum()) for sheet in workbook.sheets.values())
@@ -0,0 +1,198 @@
+"""Differential check of two XML pipelines over a corpus of Calc Sheets, so a faster engine can replace the
+current one without changing what Elmhurst receives"""
+
+import argparse
+import importlib
+import os
+import sys
+import tempfile
+import xml.etree.ElementTree as ET
+from collections import Counter
+from itertools import zip_longest
+from functions import input_reader, match_xml, emit_xml, legacy_xml, ErrorFound
+from generate import read_units
+from validation import validate_sheet
+from synthetic import build_workbook
+
+def legacy_pipeline(sheet):
+    """The original data_to_xml -> prettify -> find_and_replace chain"""
+    return legacy_xml(match_xml(input_reader(sheet)))
+
+def current_pipeline(sheet):
+    """The single pass serialisation the app uses"""
+    return emit_xml(match_xml(input_reader(sheet)))
+
+PIPELINES = {
+    'legacy': legacy_pipeline,
+    'current': current_pipeline,
+}
+
+# Synthetic Calc Sheets added to the corpus: (file name, build_workbook arguments)
+SYNTHETIC = [
+    ('template', {'units': 2}),
+    ('large', {'units': 2, 'opaque_elements': 40, 'openings': 60, 'tb_lengths': 10}),
+    ('small', {'units': 1, 'opaque_elements': 3, 'openings': 1, 'tb_lengths': 1}),
+]
+
+def load_pipeline(name):
+    """Returns the pipeline called name in PIPELINES, or the function named by a 'module:function' path.
+    A pipeline takes one unit sheet and returns its XML"""
+    if name in PIPELINES:
+        return PIPELINES[name]
+    module, _, function = name.partition(':')
+    if not function:
+        raise ErrorFound(f'Unknown pipeline {name}, use one of {", ".join(PIPELINES)} or module:function')
+    return getattr(importlib.import_module(module), function)
+
+def canonical(xml):
+    """Canonical XML (C14N 2.0), so attribute order, empty tag style and indentation do not count.
+    Only whitespace between elements is dropped, text values are kept exactly as Elmhurst receives them"""
+    root = ET.fromstring(xml)
+    for element in root.iter():
+        if len(element) and element.text and not element.text.strip():
+            element.text = None
+        if element.tail and not element.tail.strip():
+            element.tail = None
+    return ET.canonicalize(ET.tostring(root, encoding='unicode'))
+
+def first_difference(reference, candidate):
+    """Returns where two canonical XMLs first differ, as 'path: what differs', or None when they match"""
+    def walk(a, b, path):
+        if a.tag != b.tag:
+            return f'{path}: <{a.tag}> became <{b.tag}>'
+        if a.attrib != b.attrib:
+            return f'{path}: attributes {a.attrib} became {b.attrib}'
+        if (a.text or '') != (b.text or ''):
+            return f'{path}: {a.text!r} became {b.text!r}'
+        seen = {}
+        for child_a, child_b in zip_longest(a, b):
+            child = child_a if child_a is not None else child_b
+            seen[child.tag] = seen.get(child.tag, 0) + 1
+            child_path = f'{path}/{child.tag}'
+            if len((a if child_a is not None else b).findall(child.tag)) > 1:
+                child_path += f'[{seen[child.tag]}]'
+            if child_a is None:
+                return f'{child_path}: only in the candidate'
+            if child_b is None:
+                return f'{child_path}: missing from the candidate'
+            difference = walk(child_a, child_b, child_path)
+            if difference:
+                return difference
+        return None
+    a = ET.fromstring(reference)
+    b = ET.fromstring(candidate)
+    return walk(a, b, '/' + a.tag)
+
+def run_pipeline(pipeline, sheet):
+    """Returns (xml, None), or (None, error) when the pipeline raises"""
+    try:
+        return pipeline(sheet), None
+    except Exception as exc:
+        return None, f'{type(exc).__name__}: {exc}'
+
+def compare_unit(reference, candidate, sheet):
+    """Returns (outcome, first difference) of the two pipelines' XML for one unit sheet. The outcome is
+    'byte-identical', 'canonical' when the XMLs match once canonicalised, 'differing', or 'errored' when either
+    pipeline raised, even if both raised the same error"""
+    expected, expected_error = run_pipeline(reference, sheet)
+    actual, actual_error = run_pipeline(candidate, sheet)
+    if expected_error or actual_error:
+        if expected_error == actual_error:
+            return 'errored', f'both raised {expected_error}'
+        return 'errored', f'reference raised {expected_error}' if expected_error else f'candidate raised {actual_error}'
+    if expected == actual:
+        return 'byte-identical', None
+    difference = first_difference(canonical(expected), canonical(actual))
+    return ('canonical', None) if difference is None else ('differing', difference)
+
+def golden_path(folder, workbook, unit):
+    """Where the golden XML of one unit is kept: a folder per Calc Sheet, named after its file"""
+    return os.path.join(folder, os.path.splitext(os.path.basename(workbook))[0], f'{unit}.xml')
+
+def golden_reference(folder, workbook, unit):
+    """A reference pipeline that returns the unit's XML saved by save_golden, whatever the sheet"""
+    def reference(sheet):
+        with open(golden_path(folder, workbook, unit), encoding='utf-8', newline='') as file:
+            return file.read()
+    return reference
+
+def save_golden(paths, pipeline, folder):
+    """Writes the pipeline's XML of every unit of the Calc Sheets below folder, so later mapping changes can be
+    compared against a trusted run. Units with problems in their sheet are left out. Returns how many were saved"""
+    saved = 0
+    for path in paths:
+        for name, sheet in read_units(path):
+            if validate_sheet(sheet, name):
+                continue
+            target = golden_path(folder, path, name)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'w', encoding='utf-8', newline='') as file:
+                file.write(pipeline(sheet))
+            saved += 1
+    return saved
+
+def compare(paths, reference, candidate, golden=None):
+    """Yields {'workbook', 'unit', 'outcome', 'difference'} for every unit of the Calc Sheets, see compare_unit.
+    With golden, the folder given to save_golden, the saved XMLs are the reference.
+    Units with problems in their sheet are skipped, as neither pipeline would run on them"""
+    for path in paths:
+        for name, sheet in read_units(path):
+            if validate_sheet(sheet, name):
+                yield {'workbook': path, 'unit': name, 'outcome': 'skipped',
+                       'difference': 'skipped, the sheet has problems'}
+                continue
+            if golden is not None:
+                reference = golden_reference(golden, path, name)
+            outcome, difference = compare_unit(reference, candidate, sheet)
+            yield {'workbook': path, 'unit': name, 'outcome': outcome, 'difference': difference}
+
+def synthetic_corpus(folder):
+    """Builds the SYNTHETIC Calc Sheets into folder and returns their paths"""
+    return [build_workbook(os.path.join(folder, f'synthetic {name}.xlsx'), **arguments)
+            for name, arguments in SYNTHETIC]
+
+def main(argv=None):
+    """Compares two pipelines over the given Calc Sheets and the synthetic ones, and returns the exit status"""
+    parser = argparse.ArgumentParser(description='Check that two XML pipelines give the same XML for every unit')
+    parser.add_argument('workbooks', nargs='*', help='Calc Sheets to add to the corpus')
+    parser.add_argument('--reference', default='legacy', help='Trusted pipeline, by name or module:function')
+    parser.add_argument('--candidate', default='current', help='Pipeline under test, by name or module:function')
+    parser.add_argument('--no-synthetic', action='store_true', help='Only compare the given Calc Sheets')
+    golden = parser.add_mutually_exclusive_group()
+    golden.add_argument('--save-golden', metavar='FOLDER',
+                        help="Save the reference pipeline's XML of every unit into FOLDER, then stop")
+    golden.add_argument('--golden', metavar='FOLDER',
+                        help='Compare the candidate against the XML saved with --save-golden instead of --reference')
+    args = parser.parse_args(argv)
+
+    try:
+        reference = load_pipeline(args.reference)
+        candidate = load_pipeline(args.candidate)
+    except (ErrorFound, ImportError, AttributeError) as exc:
+        print(exc, file=sys.stderr)
+        return 2
+    with tempfile.TemporaryDirectory() as folder:
+        paths = list(args.workbooks)
+        if not args.no_synthetic:
+            paths += synthetic_corpus(folder)
+        stems = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+        if (args.save_golden or args.golden) and len(set(stems)) < len(stems):
+            print('Golden XMLs are kept per Calc Sheet file name, so the file names must differ', file=sys.stderr)
+            return 2
+        if args.save_golden:
+            saved = save_golden(paths, reference, args.save_golden)
+            print(f'{saved} unit(s) saved to {args.save_golden}')
+            return 0
+        results = list(compare(paths, reference, candidate, args.golden))
+
+    for result in results:
+        if result['difference']:
+            print(f'{os.path.basename(result["workbook"])} / {result["unit"]}: {result["difference"]}')
+    counts = Counter(result['outcome'] for result in results)
+    print(f'{len(results)} unit(s): {counts["byte-identical"]} byte-identical, '
+          f'{counts["canonical"]} identical once canonicalised, {counts["differing"]} differing, '
+          f'{counts["errored"]} errored')
+    return 1 if counts['differing'] or counts['errored'] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,37 +2,15 @@
 
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
-import math
+from xml.sax.saxutils import escape
+import re
+from functools import lru_cache
+from operator import attrgetter, itemgetter
+import numpy as np
 import pandas as pd
 from TBs import TBs
 from levels_naming import levels_naming
-import uuid
-import datetime
-import os
-import streamlit as st
-
-def generate_unique_name(base_name):
-    """Generate a unique name for the temp XML files to be saved locally"""
-    timestamp = datetime.datetime.now()
-    unique_string = str(uuid.uuid4().hex)
-    run_name = f"{base_name}_{str(timestamp).replace(':','-')}_{unique_string}"
-    return run_name
-
-def delete_files_in_directory(directory):
-    """Deleting all temp files"""
-    # Get the list of files in the directory
-    file_list = os.listdir(directory)
-
-    # Iterate over each file and delete it
-    for file_name in file_list:
-        file_path = os.path.join(directory, file_name)
-        try:
-            if os.path.isfile(file_path):
-                os.remove(file_path)
-                print(f"Deleted: {file_path}")
-        except Exception as e:
-            print(f"Error deleting {file_path}: {e}")
-    pass
+from model import Unit, Level, OpaqueElement, OpeningType, Opening, ThermalBridge
 
 def data_to_xml(dictionary, root_name='AssessmentFull'):
     """Converts the dictionary element to a string suitable for XML"""
@@ -61,251 +39,718 @@ def prettify(elem):
     final = prettified.replace('<?xml version="1.0" ?>\n', '')
     return final
 
-def check_missing_data(unit, sheet, input_list):
-    """Checks for any missing data and raises error if there's a mismatch"""
-    for info in input_list:
-        non_nan = sheet[info][sheet[info].notna()]
-        if len(non_nan)==0:
-            raise st.error(f'Error for {unit["propertyName"]}: "{info}" has not been entered')
-        unit[info] = sheet[info].tolist()[1]
-
-def check_opening_type_data(unit, sheet, main, inputs, this_type):
-    """Counts Openings on input types and raises error if there's a mismatch"""
-    sheet = sheet[sheet['Type']==this_type]
-    filtered_main = sheet[main][sheet[main].notna()]
-    for data in inputs:
-        filtered_input = sheet[data][sheet[data].notna()]
-        if len(filtered_input)!=len(filtered_main):
-            raise st.error(f'''Error for {unit["propertyName"]}:
-                             There is a mismatch between the number of "{main}" 
-                             elements and the corresponding "{data}"''')
-
-def check_openings_data(unit, sheet, main, inputs):
-    """Counts Openings on input and raises error if there's a mismatch"""
-    filtered_main = sheet[main][sheet[main].notna()]
-    for data in inputs:
-        filtered_input = sheet[data][sheet[data].notna()]
-        if len(filtered_input)!=len(filtered_main):
-            raise st.error(f'''Error for {unit["propertyName"]}:
-                             There is a mismatch between the number of "{main}" 
-                             elements and the corresponding "{data}"''')
-
-def check_op_element_types_names(unit, sheet):
-    """Checks if there is an inconsitant number of Element Types and Names. Also, checks Element Names to ensure each is unique"""
-    filtered_op_elem_type = sheet['Element type'][sheet['Element type'].notna()]
-    filtered_op_elem_name = sheet['Element name'][sheet['Element name'].notna()]
-    
-    # Check if all element types have a name assigned 
-    if len(filtered_op_elem_type)!=len(filtered_op_elem_name):
-        raise st.error(f'''Error for {unit["propertyName"]}:
-                         There is a mismatch between the number of
-                         "Element type" entries and the assigned "Element name"''')
-    # Check if there are non-unique element names
-    if len(set(filtered_op_elem_name)) != len(filtered_op_elem_name):
-        print(set(sheet['Element name']))
-        print(sheet['Element name'])
-        raise st.error(f'''Error for {unit["propertyName"]}:
-                         Two or more opaque element entries have the same name. 
-                         All elements require a unique name.''')
+class ErrorFound(Exception):
+    """Raised when a unit sheet cannot be turned into XML. The message says what to fix in the Calc Sheet"""
+    pass
+
+# Part of the cache key of generated units. Bump it whenever a change alters the generated XML
+GENERATOR_VERSION = '2024.2'
+
+# Elmhurst repeats these tags, so match_xml numbers them to keep the dict keys unique
+NUMBERED_TAGS = re.compile(
+    r'(Measurement|ExternalWall|PartyWall|ExternalRoof|HeatLossFloor|Floor|Roof|'
+    r'OpeningType|Opening|CommunityHeatSource)\d+'
+)
+
+XML_NAMESPACES = (
+    ' xmlns:xsd="http://www.w3.org/2001/XMLSchema"'
+    ' xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"'
+)
+
+@lru_cache(maxsize=None)
+def xml_tag(key):
+    """Returns the final Elmhurst tag for a match_xml key"""
+    if 'ThermalBridge-' in key:
+        return 'ThermalBridge'
+    numbered = NUMBERED_TAGS.fullmatch(key)
+    if numbered:
+        return numbered.group(1)
+    return key
+
+def emit_element(parts, tag, data, indent, value='replace_xsi:nul'):
+    """Appends one element of match_xml output, and everything under it, to the list of XML parts"""
+    if isinstance(data, XMLFragment):
+        data.render(parts, tag, indent)
+        return
+    if isinstance(data, dict):
+        children = data.items()
+    elif isinstance(data, list):
+        children = [('item', item) for item in data]
+    else:
+        text = str(data)
+        if text == value:
+            parts.append(f'{indent}<{tag} xsi:nil="true" />\n')
+        elif text:
+            parts.append(f'{indent}<{tag}>{escape(text)}</{tag}>\n')
+        else:
+            parts.append(f'{indent}<{tag} />\n')
+        return
+    if not children:
+        parts.append(f'{indent}<{tag} />\n')
+        return
+    parts.append(f'{indent}<{tag}>\n')
+    for key, child in children:
+        emit_element(parts, xml_tag(key), child, indent + '  ', value)
+    parts.append(f'{indent}</{tag}>\n')
+
+def emit_xml(dictionary, root_name='AssessmentFull', value='replace_xsi:nul'):
+    """Writes the match_xml output straight to the final, indented Elmhurst XML string"""
+    parts = [f'<{root_name}{XML_NAMESPACES}>\n']
+    for key, child in dictionary.items():
+        emit_element(parts, xml_tag(key), child, '  ', value)
+    parts.append(f'</{root_name}>')
+    return ''.join(parts)
+
+# Marks the entries of an XMLFragment that are filled in per unit
+PER_UNIT = object()
+
+class XMLFragment(dict):
+    """A block of match_xml output whose constant entries are serialised once per tag and indent.
+    Entries set to PER_UNIT are given by fill() and are the only ones rendered for each unit"""
+    def __init__(self, template, **values):
+        super().__init__({key: values.get(key, child) if child is PER_UNIT else child for key, child in template.items()})
+        self.template = template
+        self.values = values
+        self.compiled = {}
+
+    def fill(self, **values):
+        """Returns the fragment with its PER_UNIT entries filled in, sharing the compiled XML"""
+        filled = XMLFragment(self.template, **values)
+        filled.compiled = self.compiled
+        return filled
+
+    def compile(self, tag, indent):
+        """Serialises the constant entries, leaving a (key, tag, indent) gap for each PER_UNIT entry"""
+        chunks = [f'{indent}<{tag}>\n']
+        for key, child in self.template.items():
+            if child is PER_UNIT:
+                chunks.append((key, xml_tag(key), indent + '  '))
+                continue
+            parts = []
+            emit_element(parts, xml_tag(key), child, indent + '  ')
+            if isinstance(chunks[-1], str):
+                chunks[-1] += ''.join(parts)
+            else:
+                chunks.append(''.join(parts))
+        if isinstance(chunks[-1], str):
+            chunks[-1] += f'{indent}</{tag}>\n'
+        else:
+            chunks.append(f'{indent}</{tag}>\n')
+        self.compiled[(tag, indent)] = chunks
+        return chunks
+
+    def render(self, parts, tag, indent):
+        """Appends the compiled XML to parts, rendering only the PER_UNIT entries"""
+        chunks = self.compiled.get((tag, indent)) or self.compile(tag, indent)
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                parts.append(chunk)
+            else:
+                key, child_tag, child_indent = chunk
+                emit_element(parts, child_tag, self.values[key], child_indent)
+
+# Single-value inputs, read from the first row under each header
+GEN_INFO_LIST = [
+    'Dwelling orientation',
+    'Calculation type',
+    'Terrain type',
+    'Property type 1',
+    'Property type 2',
+    'Position of flat',
+    'Which floor',
+    'Tot no. storeys in block',
+    'No. storeys',
+    'Date built',
+    'Sheltered sides',
+    'Sunlight/sunshade',
+    'Thermal mass parameter',
+    'Living area'
+]
+MECH_VENT_LIST = [
+    'Mech vent present',
+    'Ventilation data type',
+    'Mech vent type',
+    'Vent brand model',
+    'MVHR SFP','MVHR HR',
+    'Wet rooms',
+    'System location',
+    'Duct insulation',
+    'Duct installation specs',
+    'Duct type',
+    'Air permeability @50Pa'
+]
+LIGHTING_LIST = [
+    'Lighting name',
+    'Efficacy',
+    'Power',
+    'Capacity',
+    'Count'
+]
+HEAT_NETWORKS_LIST = [
+    'Heating network type',
+    'Distribution loss space',
+    'Heating source 1 - source',
+    'Fuel type',
+    'Distribution loss',
+    'Heating controls',
+    'Percentage of heat',
+    'Overall efficiency',
+    'Heating use'
+]
+WATER_HEATING_LIST = [
+    'Water heating',
+    'Cold water source',
+    'Bath count',
+    'Shower type',
+    'Shower flowrate',
+    'Storage type'
+]
+PV_LIST = [
+    'PV present?',
+    'PV type',
+    'Cells kW peak',
+    'PV orientation',
+    'PV elevation',
+    'PV overshading'
+]
+
+# Opaque element types and the area column each one requires
+OPAQUE_ELEMENT_TYPES = [
+    'External wall',
+    'Sheltered wall',
+    'Party wall',
+    'External roof',
+    'Heat loss floor',
+    'Party ceiling',
+    'Party floor'
+]
+OPAQUE_ELEMENT_AREAS = [
+    'External wall area',
+    'Sheltered wall area',
+    'Party wall area',
+    'External roof area',
+    'Heat loss floor area',
+    'Party ceiling area',
+    'Party floor area'
+]
+
+# Inputs every opening needs alongside its name
+OPENING_INPUTS = [
+    'Opening level ref.',
+    'Opening type',
+    'Belongs to opaque element',
+    'Orientation',
+    'Width',
+    'Height',
+    'Area',
+    'Floor to ceiling?'
+]
+
+# Tabular sections of the unit sheet, each read in one go by read_rows.
+# Levels start on the first row, the other sections skip the row of units
+LEVEL_COLUMNS = [
+    'Floor to slab',
+    'Heated internal floor area',
+    'Heat loss perimeter'
+]
+OPAQUE_COLUMNS = [
+    'Level of opaque element',
+    'Element type',
+    'Element name',
+    'External wall area',
+    'External wall U-value',
+    'Sheltered wall area',
+    'Sheltered wall U-value',
+    'Sheltered wall shelter factor',
+    'Party wall area',
+    'External roof area',
+    'External roof U-value',
+    'External roof type',
+    'External roof shelter factor',
+    'Heat loss floor area',
+    'Heat loss floor U-value',
+    'Heat loss floor type',
+    'Heat loss floor shelter factor',
+    'Party ceiling area',
+    'Party floor area'
+]
+# Inputs each opaque element type needs on its own row. The first one is the area
+OPAQUE_REQUIRED = {
+    'External wall': ['External wall area', 'External wall U-value'],
+    'Sheltered wall': ['Sheltered wall area', 'Sheltered wall U-value', 'Sheltered wall shelter factor'],
+    'Party wall': ['Party wall area'],
+    'External roof': ['External roof area', 'External roof U-value', 'External roof type', 'External roof shelter factor'],
+    'Heat loss floor': ['Heat loss floor area', 'Heat loss floor U-value', 'Heat loss floor type', 'Heat loss floor shelter factor'],
+    'Party ceiling': ['Party ceiling area'],
+    'Party floor': ['Party floor area']
+}
+# Columns read into each OpaqueElement: area, U-value, shelter factor and construction type
+OPAQUE_FIELDS = {
+    'External wall': ('External wall area', 'External wall U-value', None, None),
+    'Sheltered wall': ('Sheltered wall area', 'Sheltered wall U-value', 'Sheltered wall shelter factor', None),
+    'Party wall': ('Party wall area', None, None, None),
+    'External roof': ('External roof area', 'External roof U-value', 'External roof shelter factor', 'External roof type'),
+    'Heat loss floor': ('Heat loss floor area', 'Heat loss floor U-value', 'Heat loss floor shelter factor',
+                        'Heat loss floor type'),
+    'Party ceiling': ('Party ceiling area', None, None, None),
+    'Party floor': ('Party floor area', None, None, None)
+}
+OPENING_TYPE_COLUMNS = [
+    'Opening type name',
+    'Type',
+    'Glazing type',
+    'U-value',
+    'Solar transmittance',
+    'Frame factor'
+]
+OPENING_COLUMNS = [
+    'Opening level ref.',
+    'Opening name',
+    'Opening type',
+    'Belongs to opaque element',
+    'Orientation',
+    'Area'
+]
+
+# Thermal bridge codes in sheet order, and the opaque elements whose area counts as exposed for the y-value
+TB_CODES = list(TBs)
+EXPOSED_TYPES = ('External wall', 'Sheltered wall', 'External roof', 'Heat loss floor')
+# Opaque elements openings can be placed on
+WALL_TYPES = ('External wall', 'Sheltered wall')
+# Inputs used as numbers. input_reader converts numbers stored as text and validate_sheet flags any other text
+NUMERIC_VALUES = [
+    'Which floor',
+    'Tot no. storeys in block',
+    'Date built',
+    'Sheltered sides',
+    'Wet rooms',
+    'Power',
+    'Capacity',
+    'Count',
+    'Heating controls',
+    'Bath count',
+    'Shower flowrate'
+]
+NUMERIC_COLUMNS = [
+    *LEVEL_COLUMNS,
+    *(column for column in OPAQUE_COLUMNS
+      if column not in ('Element type', 'Element name', 'External roof type', 'Heat loss floor type')),
+    'U-value',
+    'Solar transmittance',
+    'Frame factor',
+    'Opening level ref.',
+    'Width',
+    'Height',
+    'Area',
+    *TBs
+]
+# Every column input_reader looks at, so the workbook loader can skip the rest
+INPUT_COLUMNS = frozenset([
+    'Property name',
+    *GEN_INFO_LIST,
+    *LEVEL_COLUMNS,
+    *OPAQUE_COLUMNS,
+    *OPENING_TYPE_COLUMNS,
+    *OPENING_COLUMNS,
+    *OPENING_INPUTS,
+    *TBs,
+    *MECH_VENT_LIST,
+    *LIGHTING_LIST,
+    *HEAT_NETWORKS_LIST,
+    *WATER_HEATING_LIST,
+    *PV_LIST
+])
+
+def read_rows(sheet, columns, start=1):
+    """Pulls a block of columns out of the sheet once and yields (row, cells) for every row with an entered cell.
+    Blank cells are None"""
+    block = sheet[columns].iloc[start:]
+    entered = block.notna().to_numpy()
+    # Copied, as the blanks are overwritten and the sheet may be a cached upload
+    cells = block.to_numpy(dtype=object, copy=True)
+    cells[~entered] = None
+    for row in np.flatnonzero(entered.any(axis=1)).tolist():
+        yield row, cells[row].tolist()
+
+def read_values(unit, sheet, input_list):
+    """Reads the single-value inputs, which sit on the first data row under each header"""
+    unit.update(zip(input_list, sheet[input_list].iloc[1:2].to_numpy(dtype=object)[0]))
+
+def build_index(names, positions, what, unit_name):
+    """Maps each name to its position, raising if a name is duplicated or only differs by case or spacing"""
+    index = {}
+    seen = {}
+    for name, position in zip(names, positions):
+        key = str(name).strip().casefold()
+        if key in seen:
+            raise ErrorFound(f'''Error for {unit_name}: The {what} names "{seen[key]}" and "{name}" are ambiguous. 
+                             All {what}s require a unique name.''')
+        seen[key] = name
+        index[name] = position
+    return index
+
+def numeric_inputs(sheet):
+    """Returns the sheet with the numeric inputs as numbers, as they would be had they been typed as numbers.
+    Only columns holding text are converted, the text that is not a number becomes blank"""
+    converted = {column: pd.to_numeric(sheet[column], errors='coerce')
+                 for column in (*NUMERIC_VALUES, *NUMERIC_COLUMNS) if sheet[column].dtype == object}
+    return sheet.assign(**converted) if converted else sheet
+
+def opening_areas(sheet):
+    """Area of every opening row, Width × Height where no Area is entered. Blank or text cells give NaN.
+    The computed areas are rounded like the wall areas, so float noise such as 0.9 × 2.1 = 1.8900000000000001
+    reaches neither the opening nor its wall's sums"""
+    width = pd.to_numeric(sheet['Width'], errors='coerce')
+    height = pd.to_numeric(sheet['Height'], errors='coerce')
+    return pd.to_numeric(sheet['Area'], errors='coerce').fillna((width * height).map(wall_area))
+
+def wall_openings_areas(sheet, areas):
+    """Sums the areas of the openings on each parent element, in one grouped pass. Openings without an area are
+    left out, as they are not exported"""
+    placed = areas.iloc[1:] > 0
+    parents = sheet['Belongs to opaque element'].iloc[1:][placed]
+    return {parent: float(area) for parent, area in areas.iloc[1:][placed].groupby(parents).sum().items()}
 
 def input_reader(sheet):
-    """Takes in the excel sheet to begin transforming into a dictionary"""
-    # Instantiate unit dict. this will hold all the inputs from the excel sheet
-    unit = {}
-
-    # General information
-    unit['propertyName'] = sheet['Property name'].tolist()[1]
-    gen_info_list = [
-        'Dwelling orientation',
-        'Calculation type',
-        'Terrain type',
-        'Property type 1',
-        'Property type 2',
-        'Position of flat',
-        'Which floor',
-        'Tot no. storeys in block',
-        'No. storeys',
-        'Date built',
-        'Sheltered sides',
-        'Sunlight/sunshade',
-        'Thermal mass parameter',
-        'Living area'
-    ]
-    check_missing_data(unit, sheet, gen_info_list)
-
-    # Level information
-    # unit['floorToSlab'] = sheet['Floor to slab'].tolist()[1:]
-    unit['floorToSlab'] = sheet['Floor to slab'][sheet['Floor to slab'].notna()].tolist()
-    # unit['heatedIntArea'] = sheet['Heated internal floor area'].tolist()[1:]
-    unit['heatedIntArea'] = sheet['Heated internal floor area'][sheet['Heated internal floor area'].notna()].tolist()
-    # unit['heatLossPerim'] = sheet['Heat loss perimeter'].tolist()[1:]
-    unit['heatLossPerim'] = sheet['Heat loss perimeter'][sheet['Heat loss perimeter'].notna()].tolist()
-    
-    # Opaque elements
-    unit['opaqElementLevel'] = sheet['Level of opaque element'].tolist()[1:]
-    # unit['opaqElementLevel'] = sheet['Level of opaque element'][sheet['Level of opaque element'].notna()].tolist() # THIS IS NOT APPLICABLE AT THIS STAGE BECAUSE THE MATCH_XML FUNCTION REQUIRES A DATAFRAME WITH ALL ELEMENT PROPERTIES WITH SAME LENGTH
-    unit['opaqElementType'] = sheet['Element type'].tolist()[1:]
-    unit['opaqElementName'] = sheet['Element name'].tolist()[1:]
-    unit['externalWallArea'] = sheet['External wall area'].tolist()[1:]
-    unit['externalWallUvalue'] = sheet['External wall U-value'].tolist()[1:]
-    unit['shelteredWallArea'] = sheet['Sheltered wall area'].tolist()[1:]
-    unit['shelteredWallUvalue'] = sheet['Sheltered wall U-value'].tolist()[1:]
-    unit['shelterFactor'] = sheet['Sheltered wall shelter factor'].tolist()[1:]
-    unit['partylWallArea'] = sheet['Party wall area'].tolist()[1:]
-    unit['externalRoofArea'] = sheet['External roof area'].tolist()[1:]
-    unit['externalRoofUvalue'] = sheet['External roof U-value'].tolist()[1:]
-    unit['externalRoofType'] = sheet['External roof type'].tolist()[1:]
-    unit['externalRoofShelterFactor'] = sheet['External roof shelter factor'].tolist()[1:]
-    unit['heatLossFloorArea'] = sheet['Heat loss floor area'].tolist()[1:]
-    unit['heatLossFloorUvalue'] = sheet['Heat loss floor U-value'].tolist()[1:]
-    unit['heatLossFloorType'] = sheet['Heat loss floor type'].tolist()[1:]
-    unit['heatLossFloorShelterFactor'] = sheet['Heat loss floor shelter factor'].tolist()[1:]
-    unit['partyCeilingArea'] = sheet['Party ceiling area'].tolist()[1:]
-    unit['partyFloorArea'] = sheet['Party floor area'].tolist()[1:]
-
-    # Check inconsistencies in opaque elements inputs
-    check_op_element_types_names(unit, sheet)
-
-    # Checking if number of area inputs matches the number of entries of element type
-    op_elements = [
-        'External wall',
-        'Sheltered wall',
-        'Party wall',
-        'External roof',
-        'Heat loss floor',
-        'Party ceiling',
-        'Party floor'
-    ]
-    op_elements_titles = [
-        'External wall area',
-        'Sheltered wall area',
-        'Party wall area',
-        'External roof area',
-        'Heat loss floor area',
-        'Party ceiling area',
-        'Party floor area'
-    ]
-    for this_id, element in enumerate(op_elements):
-        filtered_elements = sheet['Element type'][sheet['Element type'] == element]
-        if len(filtered_elements) != len(sheet[op_elements_titles[this_id]][sheet[op_elements_titles[this_id]].notna()]):
-            raise st.error(f'''Error for {unit["propertyName"]}:
-                             An "{element}" element is missing 1 or more required inputs''')
-
-    # Opening types
-    unit['openTypeName'] = sheet['Opening type name'].tolist()[1:]
-    # unit['openTypeName'] = sheet['Opening type name'][sheet['Opening type name'].notna()].tolist() # THIS IS NOT APPLICABLE AT THIS STAGE BECAUSE THE MATCH_XML FUNCTION REQUIRES A DATAFRAME WITH ALL OPENING PROPERTIES WITH SAME LENGTH
-    unit['openingType'] = sheet['Type'].tolist()[1:]
-    unit['glzgType'] = sheet['Glazing type'].tolist()[1:]
-    unit['uVal'] = sheet['U-value'].tolist()[1:]
-    unit['gVal'] = sheet['Solar transmittance'].tolist()[1:]
-    unit['frameFactor'] = sheet['Frame factor'].tolist()[1:]
-
-    inputs_window = ['Type','U-value','Solar transmittance','Frame factor']
-    inputs_door = ['Type','U-value','Frame factor']
-    main = 'Opening type name'
-    check_opening_type_data(unit, sheet, main, inputs_window, this_type='Window')
-    check_opening_type_data(unit, sheet, main, inputs_door, this_type='Door')
-
-    # Openings
-    unit['openLevel'] = sheet['Opening level ref.'].tolist()[1:]
-    unit['openName'] = sheet['Opening name'].tolist()[1:]
-    unit['openType'] = sheet['Opening type'].tolist()[1:]
-    unit['parentElem'] = sheet['Belongs to opaque element'].tolist()[1:]
-    unit['openOrientation'] = sheet['Orientation'].tolist()[1:]
-    unit['openArea'] = sheet['Area'].tolist()[1:]
-
-    inputs_openings= [
-        'Opening level ref.',
-        'Opening type',
-        'Belongs to opaque element',
-        'Orientation',
-        'Width',
-        'Height',
-        'Area',
-        'Floor to ceiling?'
-    ]
-    main = 'Opening name'
-    check_openings_data(unit, sheet, main, inputs_openings)
-
-    # Thermal bridges
-    thermal_bridges = unit['thermalBridges'] = {}
-    for tb, _ in TBs.items():
-        thermal_bridge = {}
-        if sheet[tb][0] == 'ERROR':
-            raise st.error(f'Error for {unit["propertyName"]}: Psi value not entered for thermal bridge {tb}')
-        thermal_bridge['psi'] = sheet[tb][sheet[tb].notna()].tolist()[0]
-        thermal_bridge['lengths']  = sheet[tb][2:][sheet[tb].notna()].tolist()
-        thermal_bridges[tb] = thermal_bridge
-
-    # Mechanical ventilation
-    mech_vent_list = [
-        'Mech vent present',
-        'Ventilation data type',
-        'Mech vent type',
-        'Vent brand model',
-        'MVHR SFP','MVHR HR',
-        'Wet rooms',
-        'System location',
-        'Duct insulation',
-        'Duct installation specs',
-        'Duct type',
-        'Air permeability @50Pa'
-    ]
-    check_missing_data(unit, sheet, mech_vent_list)
-
-    # Lighting
-    lighting_list = [
-        'Lighting name',
-        'Efficacy',
-        'Power',
-        'Capacity',
-        'Count'
-    ]
-    check_missing_data(unit, sheet, lighting_list)
-
-    # Heat networks
-    heat_networks_list = [
-        'Heating network type',
-        'Distribution loss space',
-        'Heating source 1 - source',
-        'Fuel type',
-        'Distribution loss',
-        'Heating controls',
-        'Percentage of heat',
-        'Overall efficiency',
-        'Heating use'
-    ]
-    check_missing_data(unit, sheet, heat_networks_list)
-
-    # Water heating
-    water_heating_list = [
-        'Water heating',
-        'Cold water source',
-        'Bath count',
-        'Shower type',
-        'Shower flowrate',
-        'Storage type'
-    ]
-    check_missing_data(unit, sheet, water_heating_list)
-
-    # PV
-    PV_list = [
-        'PV present?',
-        'PV type',
-        'Cells kW peak',
-        'PV orientation',
-        'PV elevation',
-        'PV overshading'
-    ]
-    check_missing_data(unit, sheet, PV_list)
+    """Takes in the excel sheet and builds the Unit model. The sheet is checked beforehand by validate_sheet"""
+    sheet = numeric_inputs(sheet)
+    name = sheet['Property name'].tolist()[1]
+
+    # Single values
+    values = {}
+    for input_list in (GEN_INFO_LIST, MECH_VENT_LIST, LIGHTING_LIST, HEAT_NETWORKS_LIST, WATER_HEATING_LIST, PV_LIST):
+        read_values(values, sheet, input_list)
+
+    # Levels. Each input is entered once per storey, from the first row
+    level_inputs = [sheet[column].dropna().tolist() for column in LEVEL_COLUMNS]
+    if len(set(map(len, level_inputs))) > 1:
+        raise ErrorFound(f'''Error for {name}: 
+                        One or multiple inputs among ["Floor to slab", "Heat loss perimeter", 
+                        "Heated internal area"] have not been entered''')
+    levels = tuple(Level(*level) for level in zip(*level_inputs))
+
+    # Openings, so the walls can be given the area of their openings
+    areas = opening_areas(sheet)
+    openings_areas = wall_openings_areas(sheet, areas)
+
+    # Opaque elements of a known type, with the inputs of that type picked out
+    opaque_elements = []
+    for row, cells in read_rows(sheet, OPAQUE_COLUMNS):
+        inputs = dict(zip(OPAQUE_COLUMNS, cells))
+        element_type = inputs['Element type']
+        if element_type not in OPAQUE_FIELDS:
+            continue
+        area, u_value, shelter_factor, construction_type = (
+            inputs[column] if column else None for column in OPAQUE_FIELDS[element_type]
+        )
+        complete = all(inputs[column] is not None for column in OPAQUE_REQUIRED[element_type]) and area > 0
+        openings_area = net_area = None
+        if element_type in WALL_TYPES:
+            openings_area = openings_areas.get(inputs['Element name'], 0.0)
+            net_area = area - openings_area if complete else None
+        opaque_elements.append(OpaqueElement(row, inputs['Level of opaque element'], element_type,
+                                             inputs['Element name'], area, u_value, shelter_factor,
+                                             construction_type, openings_area, net_area, complete))
+
+    # Opening types and openings
+    opening_types = tuple(OpeningType(row, *cells) for row, cells in read_rows(sheet, OPENING_TYPE_COLUMNS))
+    openings = tuple(Opening(row, *cells) for row, cells in read_rows(sheet.assign(Area=areas), OPENING_COLUMNS))
+
+    # Thermal bridges with lengths, read as one array. The psi value sits on the first row and the lengths start
+    # on the third. The heat loss of every junction is worked out at once
+    tb_block = sheet[TB_CODES].to_numpy(dtype=float)
+    psi = tb_block[0]
+    lengths = tb_block[2:]
+    entered = ~np.isnan(lengths)
+    heat_loss = psi * np.where(entered, lengths, 0).sum(axis=0)
+    thermal_bridges = tuple(
+        ThermalBridge(TB_CODES[this_id], float(psi[this_id]), tuple(lengths[entered[:, this_id], this_id].tolist()),
+                      float(heat_loss[this_id]))
+        for this_id in np.flatnonzero(entered.any(axis=0)).tolist()
+    )
+
+    return Unit(name, values, levels, tuple(opaque_elements), opening_types, openings, thermal_bridges)
 
-    return unit
+def thermal_bridge_totals(unit):
+    """Heat loss of each junction, the total HTB, the exposed area and the y-value (HTB / exposed area) of a unit.
+    The exposed area is that of the complete walls, roofs and heat loss floors, as written to the XML"""
+    heat_loss = {bridge.code: bridge.heat_loss for bridge in unit.thermal_bridges}
+    htb = sum(heat_loss.values())
+    exposed_area = sum(element.area for element in unit.opaque_elements
+                       if element.complete and element.type in EXPOSED_TYPES)
+    return {
+        'unit': unit.name,
+        'htb_w_k': htb,
+        'exposed_area_m2': exposed_area,
+        'y_value_w_m2k': htb / exposed_area if exposed_area else None,
+        **{tb: heat_loss.get(tb, 0.0) for tb in TB_CODES}
+    }
+
+# Empty main heating system that Elmhurst requires as input
+MAIN_HEATING_SYSTEM = XMLFragment({
+    'HeatingDataType': 'None',
+    'Fraction': 0,
+    'PcdfIndex': 0,
+    'BoilerEfficiencyType': 'replace_xsi:nul',
+    'EfficiencyWinter': 0,
+    'EfficiencySummer': 0,
+    'TestMethod': 'replace_xsi:nul',
+    'MHSCtrlPcdfIndex': 'replace_xsi:nul',
+    'CompensatorPcdfIndex': 'replace_xsi:nul',
+    'HetasApprovedSystem': 'false',
+    'FlueType': 'replace_xsi:nul',
+    'FanAssistedFlue': 'false',
+    'McsCertificate': 'false',
+    'Pumped': 'replace_xsi:nul',
+    'HeatingPumpAge': 'replace_xsi:nul',
+    'OilPumpInside': 'false',
+    'HeatEmitter': 'replace_xsi:nul',
+    'UnderfloorHeating': 'replace_xsi:nul',
+    'CombiType': 'replace_xsi:nul',
+    'CombiKeepHotType': 'replace_xsi:nul',
+    'CombiStoreType': 'replace_xsi:nul',
+    'ElectricCPSUtemperature': 'replace_xsi:nul',
+    'FIcase': 'replace_xsi:nul',
+    'FIwater': 'replace_xsi:nul',
+    'BurnerControl': 'replace_xsi:nul',
+    'DelayedStartStat': 'false',
+    'FlowTemperature': 'replace_xsi:nul',
+    'BoilerInterlock': 'false',
+    'StorageHeaters': {},
+    'FlowTemperatureValue': 'replace_xsi:nul',
+    'SapCode': 'replace_xsi:nul',
+    'FuelType': 'replace_xsi:nul',
+    'CtrlSapCode': 'replace_xsi:nul'
+})
+
+# Empty secondary heating system that Elmhurst requires as input
+SECONDARY_HEATING = XMLFragment({
+    'HeatingDataType': 'None',
+    'TestMethod': 'replace_xsi:nul',
+    'HetasApprovedSystems': 'false',
+    'Efficiency': 'replace_xsi:nul',
+    'SapCode': 0,
+    'FuelType': 'replace_xsi:nul'
+})
+
+# Empty community heat source, for the four Elmhurst slots after the first
+UNUSED_HEAT_SOURCE = XMLFragment({
+    'Source': 'None',
+    'Fraction': 'replace_xsi:nul',
+    'FuelType': 'replace_xsi:nul',
+    'OveralEfficiency': 'replace_xsi:nul',
+    'HeatPowerRatio': 'replace_xsi:nul',
+    'ElectricalEfficiency': 'replace_xsi:nul',
+    'HeatEfficiency': 'replace_xsi:nul',
+    'HeatingUse': PER_UNIT,
+    'CHPFuelFactor': 'replace_xsi:nul',
+    'EfficiencyType': 'replace_xsi:nul'
+})
+
+# Water heating system, with the sheet inputs filled in per unit
+WATER_HEATING_SYSTEM = XMLFragment({
+    'WaterHeatingType': PER_UNIT,
+    'LowWaterUse': 'false',
+    'ImmersionHeaterType': 'replace_xsi:nul',
+    'SummerImmersion': 'false',
+    'SuplementaryImmersion': 'false',
+    'ImmersionOnlyHeatingHotWater': 'false',
+    'ThermalStore': 'None',
+    'ThermalStorePipework': 'replace_xsi:nul',
+    'HotWaterCylinder': PER_UNIT,
+    'InsulationType': 'replace_xsi:nul',
+    'InsulationThickness': 'replace_xsi:nul',
+    'InsulationThicknessType': 'replace_xsi:nul',
+    'Volume': 'replace_xsi:nul',
+    'CylinderStat': 'false',
+    'PipeworkInsulation': 'replace_xsi:nul',
+    'InHeatedSpace': 'false',
+    'InAiringCupboard': 'false',
+    'SeparateTimeControl': 0,
+    'LossFactor': 1.46,
+    'SolarPanelType': 'replace_xsi:nul',
+    'SolarAreaType': 'Aperture',
+    'SolarArea': 0,
+    'SolarNi': 0,
+    'SolarA1': 0,
+    'SolarA2': 0,
+    'SolarAGRatio': 0,
+    'SolarLoopEfficiency': 0.9,
+    'SolarKhem': 0,
+    'SolarHeatLossCoeff': 'replace_xsi:nul',
+    'SolarIsFromCommunity': 'false',
+    'SolarServiceProvision': 'replace_xsi:nul',
+    'SolarPanelOrientation': 'replace_xsi:nul',
+    'SolarElevation': 'replace_xsi:nul',
+    'SolarOvershadingType': 'replace_xsi:nul',
+    'SolarVolume': 'replace_xsi:nul',
+    'SolarPumpElectricallyPowered': 'false',
+    'SolarCombinedCylinder': 'false',
+    'ColdWaterSource': PER_UNIT,
+    'BathCount': PER_UNIT,
+    'WWHRSBathCount': 'replace_xsi:nul',
+    'SapCode': 901,
+    'FuelType': 'replace_xsi:nul',
+    'HIUPcdfIndex': 'replace_xsi:nul'
+})
+
+# Plot details, with the property name filled in per unit
+PLOT = XMLFragment({
+    'Reference': PER_UNIT,
+    'TypeReference': PER_UNIT,
+    'RegsRegion': 'England',
+    'Region': 'Thames',
+    'HouseName': [],
+    'HouseNumber': [],
+    'Postcode': [],
+    'Street': [],
+    'Town': [],
+    'County': [],
+    'ClientId': 'replace_xsi:nul',
+    'UPRN': [],
+    'AddressLine1': [],
+    'AddressLine2': [],
+    'AddressLine3': [],
+    'TownAsDesigned': [],
+    'PostcodeAsDesigned': [],
+    'AssessorId': '47929',
+    'Id': '231765',
+    'GroupId': '32079',
+    'SubGroupId': 'replace_xsi:nul',
+    'AssessorCode': [],
+    'AssessorTitle': [],
+    'AssessorName': [],
+    'AssessorSurname': []
+})
+
+class ElementField:
+    """An OPAQUE_MAPPING entry read from the `field` of each OpaqueElement, passed through convert if given"""
+    def __init__(self, field, convert=None):
+        self.field = field
+        self.convert = convert
+
+def wall_area(area):
+    """Wall areas are written to three decimals. Adding 0.0 turns a rounded -0.0 into 0.0"""
+    return round(area, 3) + 0.0
+
+def storey_index(level):
+    """Elmhurst name of the storey a level reference points at"""
+    return levels_naming[str(int(level-1))]
+
+# How each opaque element type is written: the group it goes in, the prefix of its keys and its entries.
+# The source columns are in OPAQUE_FIELDS and the required inputs in OPAQUE_REQUIRED
+OPAQUE_MAPPING = {
+    'External wall': ('ExternalWalls', 'ExternalWall', {
+        'Description': ElementField('name'),
+        'Construction': 'Other',
+        'Kappa': 0,
+        'GrossArea': ElementField('area', wall_area),
+        'Uvalue': ElementField('u_value'),
+        'ShelterFactor': 0,
+        'ShelterCode': None,
+        'Type': 'Cavity',
+        'AreaCalculationType': 'Gross',
+        'OpeningsArea': ElementField('openings_area', wall_area),
+        'NettArea': ElementField('net_area', wall_area)
+    }),
+    'Sheltered wall': ('ExternalWalls', 'ExternalWall', {
+        'Description': ElementField('name'),
+        'Construction': 'Other',
+        'Kappa': 0,
+        'GrossArea': ElementField('area', wall_area),
+        'Uvalue': ElementField('u_value'),
+        'ShelterFactor': ElementField('shelter_factor'),
+        'ShelterCode': None,
+        'Type': 'Cavity',
+        'AreaCalculationType': 'Gross',
+        'OpeningsArea': ElementField('openings_area', wall_area),
+        'NettArea': ElementField('net_area', wall_area)
+    }),
+    'Party wall': ('PartyWalls', 'PartyWall', {
+        'Description': ElementField('name'),
+        'Construction': 'Other',
+        'Kappa': 0,
+        'GrossArea': ElementField('area', wall_area),
+        'Uvalue': 0,
+        'ShelterFactor': 0,
+        'ShelterCode': None,
+        'Type': 'FilledWithEdge'
+    }),
+    'External roof': ('ExternalRoofs', 'ExternalRoof', {
+        'Description': ElementField('name'),
+        'StoreyIndex': ElementField('level', storey_index),
+        'Construction': 'Other',
+        'Kappa': 0,
+        'GrossArea': ElementField('area'),
+        'Type': ElementField('construction_type'),
+        'UValue': ElementField('u_value'),
+        'ShelterFactor': ElementField('shelter_factor'),
+        'ShelterCode': None,
+        'AreaCalculationType': 'Gross',
+        'OpeningsArea': 'replace_xsi:nul',
+        'NettArea': 0
+    }),
+    'Heat loss floor': ('HeatlossFloors', 'HeatLossFloor', {
+        'Description': ElementField('name'),
+        'Construction': 'Other',
+        'Kappa': 0,
+        'Area': ElementField('area'),
+        'StoreyIndex': ElementField('level', storey_index),
+        'Type': ElementField('construction_type'),
+        'UValue': ElementField('u_value'),
+        'ShelterFactor': ElementField('shelter_factor'),
+        'ShelterCode': None
+    }),
+    'Party ceiling': ('PartyRoofs', 'Roof', {
+        'Description': ElementField('name'),
+        'StoreyIndex': ElementField('level', storey_index),
+        'Construction': 'Other',
+        'Kappa': 0,
+        'GrossArea': ElementField('area')
+    }),
+    'Party floor': ('PartyFloors', 'Floor', {
+        'Description': ElementField('name'),
+        'Construction': 'Other',
+        'Kappa': 0,
+        'Area': ElementField('area'),
+        'StoreyIndex': ElementField('level', storey_index)
+    })
+}
+
+def compile_opaque_builder(element_type, prefix, entries):
+    """Turns one OPAQUE_MAPPING entry into a function building the XML of all the elements of that type at once.
+    The constant entries are serialised once, in an XMLFragment, and only the element fields are read per element"""
+    fragment = XMLFragment({key: PER_UNIT if isinstance(entry, ElementField) else entry
+                            for key, entry in entries.items()})
+    fields = [(key, attrgetter(entry.field), entry.convert or (lambda value: value))
+              for key, entry in entries.items() if isinstance(entry, ElementField)]
+    def build(elements):
+        """Returns (row, key, fragment) for each element"""
+        built = []
+        for element in elements:
+            try:
+                values = {key: convert(get(element)) for key, get, convert in fields}
+            except Exception as exc:
+                # Only the storey lookup can fail, the other inputs are checked before match_xml runs
+                raise ErrorFound(f'The level reference entered for {element_type} is not listed under "Levels"') from exc
+            built.append((element.row, f'{prefix}{element.row}', fragment.fill(**values)))
+        return built
+    return build
+
+# element type -> (group, builder), compiled once at import
+OPAQUE_BUILDERS = {
+    element_type: (group, compile_opaque_builder(element_type, prefix, entries))
+    for element_type, (group, prefix, entries) in OPAQUE_MAPPING.items()
+}
 
 def match_xml(input_unit):
     """Begins matchings the dict format to a nested dictionaries for easier export to XML"""
     # Instantiate output_data dict
     output_data = {}
 
+    # Entered levels, in sheet order
+    levels = input_unit.levels
+
     # Output data for general unit info
     assessment = output_data['Assessment'] = {}
     assessment['Reference'] = input_unit['propertyName']
@@ -320,7 +765,7 @@ def match_xml(input_unit):
     assessment['PositionOfFlat'] = input_unit['Position of flat']
     assessment['FlatWhichFloor'] = int(input_unit['Which floor'])
     assessment['StoreysInBlock'] = int(input_unit['Tot no. storeys in block'])
-    assessment['Storeys'] = len([1 for x in input_unit['floorToSlab'] if x > 0])
+    assessment['Storeys'] = sum(1 for level in levels if level.floor_to_slab > 0)
     assessment['DateBuilt'] = int(input_unit['Date built'])
     assessment['PropertyAgeBand'] = 'replace_xsi:nul'
     assessment['ShelteredSides'] = int(input_unit['Sheltered sides'])
@@ -337,200 +782,49 @@ def match_xml(input_unit):
 
     # Looping through 10 measurements (storeys), as expected by the XML input in Elmhurst
     # If the storey is not present in the sheet, the output will be just all Os.
-    filtered_heat_loss_perim = [x for x in input_unit['heatLossPerim'] if not math.isnan(x)]
-    filtered_heated_int_area = [x for x in input_unit['heatedIntArea'] if not math.isnan(x)]
-    filtered_floor_to_slab = [x for x in input_unit['floorToSlab'] if not math.isnan(x)]
-
-    if len(filtered_heat_loss_perim) == len(filtered_heated_int_area) == len(filtered_floor_to_slab):
-        pass
-    else:
-        raise st.error(f'''Error for {input_unit["propertyName"]}: 
-                        One or multiple inputs among ["Floor to slab", "Heat loss perimeter", 
-                        "Heated internal area"] have not been entered''')
-
     for msrmt in range(9):
         measurement = {}
-        if msrmt>0:
-            try:
-                if math.isnan(input_unit['heatLossPerim'][msrmt-1]):
-                    measurement['Storey'] = msrmt
-                    measurement['InternalPerimeter'] = 0
-                    measurement['InternalFloorArea'] = 0
-                    measurement['StoreyHeight'] = 0
-                else:
-                    measurement['Storey'] = msrmt
-                    measurement['InternalPerimeter'] = input_unit['heatLossPerim'][msrmt-1]
-                    measurement['InternalFloorArea'] = input_unit['heatedIntArea'][msrmt-1]
-                    measurement['StoreyHeight'] = input_unit['floorToSlab'][msrmt-1]
-            except:
-                measurement['Storey'] = msrmt
-                measurement['InternalPerimeter'] = 0
-                measurement['InternalFloorArea'] = 0
-                measurement['StoreyHeight'] = 0
-        else: #for some reason, Elmhurst expects an empty Storey 0
-            measurement['Storey'] = msrmt
+        measurement['Storey'] = msrmt
+        #for some reason, Elmhurst expects an empty Storey 0
+        if 0 < msrmt <= len(levels):
+            level = levels[msrmt-1]
+            measurement['InternalPerimeter'] = level.heat_loss_perimeter
+            measurement['InternalFloorArea'] = level.heated_area
+            measurement['StoreyHeight'] = level.floor_to_slab
+        else:
             measurement['InternalPerimeter'] = 0
             measurement['InternalFloorArea'] = 0
             measurement['StoreyHeight'] = 0
         measurements[f'Measurement{msrmt}']  = measurement
 
     # Instantiate empty dictionaries for opqaue elements
-    ext_walls = assessment['ExternalWalls'] = {}
-    party_walls = assessment['PartyWalls'] = {}
+    assessment['ExternalWalls'] = {}
+    assessment['PartyWalls'] = {}
     assessment['InternalPartitions'] = []
-    ext_roofs = assessment['ExternalRoofs'] = {}
-    party_roofs = assessment['PartyRoofs'] = {}
+    assessment['ExternalRoofs'] = {}
+    assessment['PartyRoofs'] = {}
     assessment['InternalCeilings'] = []
-    heatloss_floors = assessment['HeatlossFloors'] = {}
-    party_floors = assessment['PartyFloors'] = {}
+    assessment['HeatlossFloors'] = {}
+    assessment['PartyFloors'] = {}
     assessment['InternalFloors'] = []
 
-    op_elements = [
-        'opaqElementType',
-        "externalWallArea",
-        "externalWallUvalue",
-        "shelteredWallArea",
-        "shelteredWallUvalue",
-        "shelterFactor",
-        "partylWallArea",
-        "externalRoofArea",
-        "externalRoofUvalue",
-        "externalRoofType",
-        "externalRoofShelterFactor",
-        "heatLossFloorArea",
-        "heatLossFloorUvalue",
-        "heatLossFloorType",
-        "heatLossFloorShelterFactor",
-        "partyCeilingArea",
-        "partyFloorArea"
-    ]
-    op_elements_dict = {col: input_unit[col] for col in op_elements}
-    op_elements_df = pd.DataFrame.from_dict(op_elements_dict)
-
-    # Looping through the opaque elements and checking what element type it is.
-    # Each type has different outputs
-    for this_id, this_type in enumerate(input_unit['opaqElementType']):
-        row = op_elements_df.loc[this_id]
-        if this_type == 'External wall':
-            filtered_row = row[1:3][row[1:3].notna()]
-            if len(filtered_row)>1:
-                ext_wall = {}
-                ext_wall['Description'] = input_unit['opaqElementName'][this_id]
-                ext_wall['Construction'] = 'Other'
-                ext_wall['Kappa'] = 0
-                ext_wall['GrossArea'] = round(input_unit['externalWallArea'][this_id],3)
-                ext_wall['Uvalue'] = input_unit['externalWallUvalue'][this_id]
-                ext_wall['ShelterFactor'] = 0
-                ext_wall['ShelterCode'] = None
-                ext_wall['Type'] = 'Cavity'
-                ext_wall['AreaCalculationType'] = 'Gross'
-                ext_wall['OpeningsArea'] = 'replace_xsi:nul'
-                ext_wall['NettArea'] = 0
-                ext_walls[f'ExternalWall{this_id}'] = ext_wall
-            else:
-                raise st.error(f'Error for {input_unit["propertyName"]}: An "External wall" element is missing 1 or more required inputs')
-        elif this_type == 'Sheltered wall':
-            filtered_row = row[2:6][row[2:6].notna()]
-            if len(filtered_row)>2:
-                shelt_wall = {}
-                shelt_wall['Description'] = input_unit['opaqElementName'][this_id]
-                shelt_wall['Construction'] = 'Other'
-                shelt_wall['Kappa'] = 0
-                shelt_wall['GrossArea'] = round(input_unit['shelteredWallArea'][this_id],3)
-                shelt_wall['Uvalue'] = input_unit['shelteredWallUvalue'][this_id]
-                shelt_wall['ShelterFactor'] = input_unit['shelterFactor'][this_id]
-                shelt_wall['ShelterCode'] = None
-                shelt_wall['Type'] = 'Cavity'
-                shelt_wall['AreaCalculationType'] = 'Gross'
-                shelt_wall['OpeningsArea'] = 'replace_xsi:nul'
-                shelt_wall['NettArea'] = 0
-                ext_walls[f'ExternalWall{this_id}'] = shelt_wall
-            else:
-                raise st.error(f'Error for {input_unit["propertyName"]}: A "Sheltered wall" element is missing 1 or more required inputs')
-        elif this_type == 'Party wall':
-            if row.iloc[6]>0:
-                party_wall = {}
-                party_wall['Description'] = input_unit['opaqElementName'][this_id]
-                party_wall['Construction'] = 'Other'
-                party_wall['Kappa'] = 0
-                party_wall['GrossArea'] = round(input_unit['partylWallArea'][this_id],3)
-                party_wall['Uvalue'] = 0
-                party_wall['ShelterFactor'] = 0
-                party_wall['ShelterCode'] = None
-                party_wall['Type'] = 'FilledWithEdge'
-                party_walls[f'PartyWall{this_id}'] = party_wall
-            else:
-                raise st.error(f'Error for {input_unit["propertyName"]}: A "Party wall" element is missing 1 or more required inputs')
-        elif this_type == 'External roof':
-            filtered_row = row[7:11][row[7:11].notna()]
-            print(filtered_row)
-            if len(filtered_row)==4:
-                ext_roof = {}
-                ext_roof['Description'] = input_unit['opaqElementName'][this_id]
-                try:
-                    ext_roof['StoreyIndex'] = levels_naming[str(int(input_unit['opaqElementLevel'][this_id]-1))]
-                except Exception as exc:
-                    raise st.error(f'The level reference entered for {this_type} is not listed under "Levels"') from exc
-                ext_roof['Construction'] = 'Other'
-                ext_roof['Kappa'] = 0
-                ext_roof['GrossArea'] = input_unit['externalRoofArea'][this_id]
-                ext_roof['Type'] = input_unit['externalRoofType'][this_id]
-                ext_roof['UValue'] = input_unit['externalRoofUvalue'][this_id]
-                ext_roof['ShelterFactor'] = input_unit['externalRoofShelterFactor'][this_id]
-                ext_roof['ShelterCode'] = None
-                ext_roof['AreaCalculationType'] = 'Gross'
-                ext_roof['OpeningsArea'] = 'replace_xsi:nul'
-                ext_roof['NettArea'] = 0
-                ext_roofs[f'ExternalRoof{this_id}'] = ext_roof
-            else:
-                raise st.error(f'Error for {input_unit["propertyName"]}: An "External roof" element is missing 1 or more required inputs')
-        elif this_type == 'Heat loss floor':
-            filtered_row = row[11:15][row[11:15].notna()]
-            if len(filtered_row)==4:
-                heatloss_floor = {}
-                heatloss_floor['Description'] = input_unit['opaqElementName'][this_id]
-                heatloss_floor['Construction'] = 'Other'
-                heatloss_floor['Kappa'] = 0
-                heatloss_floor['Area'] = input_unit['heatLossFloorArea'][this_id]
-                try:
-                    heatloss_floor['StoreyIndex'] = levels_naming[str(int(input_unit['opaqElementLevel'][this_id]-1))]
-                except Exception as exc:
-                    raise st.error(f'The level reference entered for {this_type} is not listed under "Levels"') from exc
-                heatloss_floor['Type'] = input_unit['heatLossFloorType'][this_id]
-                heatloss_floor['UValue'] = input_unit['heatLossFloorUvalue'][this_id]
-                heatloss_floor['ShelterFactor'] = input_unit['heatLossFloorShelterFactor'][this_id]
-                heatloss_floor['ShelterCode'] = None
-                heatloss_floors[f'HeatLossFloor{this_id}'] = heatloss_floor
-            else:
-                raise st.error(f'Error for {input_unit["propertyName"]}: A "Heat loss floor" element is missing 1 or more required inputs')
-        elif this_type == 'Party ceiling':
-            if row.iloc[15]>0:
-                party_roof = {}
-                party_roof['Description'] = input_unit['opaqElementName'][this_id]
-                try:
-                    party_roof['StoreyIndex'] = levels_naming[str(int(input_unit['opaqElementLevel'][this_id]-1))]
-                except Exception as exc:
-                    raise st.error(f'The level reference entered for {this_type} is not listed under "Levels"') from exc
-                party_roof['Construction'] = 'Other'
-                party_roof['Kappa'] = 0
-                party_roof['GrossArea'] = input_unit['partyCeilingArea'][this_id]
-                party_roofs[f'Roof{this_id}'] = party_roof
-            else:
-                raise st.error(f'Error for {input_unit["propertyName"]}: A "Party ceiling" element is missing 1 or more required inputs')
-        elif this_type == 'Party floor':
-            if row.iloc[16]>0:
-                party_floor = {}
-                party_floor['Description'] = input_unit['opaqElementName'][this_id]
-                party_floor['Construction'] = 'Other'
-                party_floor['Kappa'] = 0
-                party_floor['Area'] = input_unit['partyFloorArea'][this_id]
-                try:
-                    party_floor['StoreyIndex'] = levels_naming[str(int(input_unit['opaqElementLevel'][this_id]-1))]
-                except Exception as exc:
-                    raise st.error(f'The level reference entered for {this_type} is not listed under "Levels"') from exc
-                party_floors[f'Floor{this_id}'] = party_floor
-            else:
-                raise st.error(f'Error for {input_unit["propertyName"]}: A "Party floor" element is missing 1 or more required inputs')
+    # Opaque elements, built type by type with OPAQUE_BUILDERS. Keys use the sheet row, so they stay unique,
+    # and each group keeps the sheet order, which LocationWallIndex relies on
+    for element in input_unit.opaque_elements:
+        if not element.complete:
+            article = 'An' if element.type[0] in 'AEIOU' else 'A'
+            raise ErrorFound(f'Error for {input_unit["propertyName"]}: {article} "{element.type}" element is missing 1 or more required inputs')
+    by_type = {}
+    for element in input_unit.opaque_elements:
+        by_type.setdefault(element.type, []).append(element)
+    groups = {}
+    for element_type, elements in by_type.items():
+        group, build = OPAQUE_BUILDERS[element_type]
+        groups.setdefault(group, []).extend(build(elements))
+    for group, built in groups.items():
+        built.sort(key=itemgetter(0))
+        assessment[group].update((key, fragment) for _, key, fragment in built)
+
     # Misc objects that need to be included in the XML for Elmhurst
     # (but currently are not allowed to be entered in the excel sheet)
     assessment['ThermalBridgesCalculation'] = 'CalculateBridges'
@@ -600,79 +894,92 @@ def match_xml(input_unit):
     assessment['OpeningTypes'] = {}
     opening_types = assessment['OpeningTypes'] = {}
 
-    # Looping through each opening type and only including if data is entered
-    for this_id, name in enumerate(input_unit['openTypeName']):
-        if input_unit['uVal'][this_id]>0:
-            opening_type = {}
-            opening_type['Description'] = name
-            opening_type['DataSource'] = 'Manufacturer'
-            opening_type['Type'] = input_unit['openingType'][this_id]
-            if input_unit['openingType'][this_id]=='Window':
-                opening_type['Glazing'] = 'Double'
-                opening_type['GlazingGap'] = 'replace_xsi:nul'
-                opening_type['GlazingFillingType'] = None
-                opening_type['SolarTrans'] = input_unit['gVal'][this_id]
-            else:
-                opening_type['Glazing'] = 'replace_xsi:nul'
-                opening_type['GlazingGap'] = 'replace_xsi:nul'
-                opening_type['GlazingFillingType'] = None
-                opening_type['SolarTrans'] = 0
-            opening_type['FrameType'] = 'Wood'
-            opening_type['FrameFactor'] = input_unit['frameFactor'][this_id]
-            opening_type['UValue'] = input_unit['uVal'][this_id]
-            opening_types[f'OpeningType{this_id}'] = opening_type
+    # Looping through each opening type and only including if a U-value is entered
+    for entered_type in input_unit.opening_types:
+        if entered_type.u_value is None or not entered_type.u_value > 0:
+            continue
+        this_id = entered_type.row
+        opening_type = {}
+        opening_type['Description'] = entered_type.name
+        opening_type['DataSource'] = 'Manufacturer'
+        opening_type['Type'] = entered_type.type
+        if entered_type.type=='Window':
+            opening_type['Glazing'] = 'Double'
+            opening_type['GlazingGap'] = 'replace_xsi:nul'
+            opening_type['GlazingFillingType'] = None
+            opening_type['SolarTrans'] = entered_type.solar_transmittance
+        else:
+            opening_type['Glazing'] = 'replace_xsi:nul'
+            opening_type['GlazingGap'] = 'replace_xsi:nul'
+            opening_type['GlazingFillingType'] = None
+            opening_type['SolarTrans'] = 0
+        opening_type['FrameType'] = 'Wood'
+        opening_type['FrameFactor'] = entered_type.frame_factor
+        opening_type['UValue'] = entered_type.u_value
+        opening_types[f'OpeningType{this_id}'] = opening_type
 
     # Output data for openings
     openings = assessment['Openings'] = {}
 
-    # Looping through each opening and only including if data is entered
-    for this_id, name in enumerate(input_unit['openName']):
-        # Write inputs only if area is entered
-        if input_unit['openArea'][this_id]>0:
-            # Check for refernece levels that have not been listed in "levels"
-            try:
-                levels_naming[str(int(input_unit['openLevel'][this_id]-1))]
-            except Exception as exc:
-                raise st.error(f'The level reference entered for opening "{name}" is not listed under "Levels"') from exc
-
-            opening = {}
-            opening['this_id'] = this_id
-            for this_ido,this_type in enumerate(input_unit['openTypeName']):
-                if input_unit['openType'][this_id] == this_type:
-                    opening['OpeningTypeIndex'] = this_ido
-            opening['Description'] = name
-            opening['LocationBuildingPartIndex'] = 0
-
-            counter = 0
-            wall_list = []
-            for this_ido, this_type in enumerate(input_unit['opaqElementType']):
-                if this_type == "External wall" or this_type == "Sheltered wall":
-                    wall_list.append(input_unit['opaqElementName'][this_ido])
-            for this_ido,parent in enumerate(wall_list):
-                if input_unit['parentElem'][this_id] == parent:
-                    opening['LocationWallIndex'] = this_ido
-                    counter+=1
-            if counter == 0:
-                raise st.error(f'''The parent element "{input_unit["parentElem"][this_id]}" 
-                                referred by the "{name}" opening element does not exist 
-                                or it is not an External or Sheltered wall''')
-            opening['LocationRoofIndex'] = 'replace_xsi:nul'
-            opening['Orientation'] = input_unit['openOrientation'][this_id]
-            opening['AreaType'] = 'Total'
-            opening['AreaScaleType'] = 'Meters'
-            opening['Area'] = input_unit['openArea'][this_id]
-            opening['AreaRecCalculation'] = []
-            opening['RoofLightsPitch'] = 0
-            openings[f'Opening{this_id}'] = opening
+    # Name -> index maps, built once so each opening resolves its type and wall in constant time.
+    # OpeningTypeIndex is the row of the opening type, LocationWallIndex the position among the walls
+    named_types = [entered_type for entered_type in input_unit.opening_types if entered_type.name is not None]
+    opening_type_index = build_index(
+        [entered_type.name for entered_type in named_types],
+        [entered_type.row for entered_type in named_types],
+        'opening type',
+        input_unit['propertyName']
+    )
+    wall_names = [
+        element.name for element in input_unit.opaque_elements
+        if element.type in WALL_TYPES
+    ]
+    wall_index = build_index(wall_names, range(len(wall_names)), 'wall', input_unit['propertyName'])
+
+    # Looping through each opening and only including it if an area is entered
+    for entered_opening in input_unit.openings:
+        if entered_opening.area is None or not entered_opening.area > 0:
+            continue
+        this_id = entered_opening.row
+        name = entered_opening.name
+        # Check for refernece levels that have not been listed in "levels"
+        try:
+            levels_naming[str(int(entered_opening.level-1))]
+        except Exception as exc:
+            raise ErrorFound(f'The level reference entered for opening "{name}" is not listed under "Levels"') from exc
+
+        opening = {}
+        opening['this_id'] = this_id
+        type_id = opening_type_index.get(entered_opening.type)
+        if type_id is not None:
+            opening['OpeningTypeIndex'] = type_id
+        opening['Description'] = name
+        opening['LocationBuildingPartIndex'] = 0
+
+        wall_id = wall_index.get(entered_opening.parent)
+        if wall_id is None:
+            raise ErrorFound(f'''The parent element "{entered_opening.parent}" 
+                            referred by the "{name}" opening element does not exist 
+                            or it is not an External or Sheltered wall''')
+        opening['LocationWallIndex'] = wall_id
+        opening['LocationRoofIndex'] = 'replace_xsi:nul'
+        opening['Orientation'] = entered_opening.orientation
+        opening['AreaType'] = 'Total'
+        opening['AreaScaleType'] = 'Meters'
+        opening['Area'] = entered_opening.area
+        opening['AreaRecCalculation'] = []
+        opening['RoofLightsPitch'] = 0
+        openings[f'Opening{this_id}'] = opening
 
     # Output data for thermal bridges
     thermal_bridges = assessment['ThermalBridges'] = {}
 
     # Looping through each TB and only including if data is entered
-    for tb,name in TBs.items():
-        lengths = input_unit['thermalBridges'][tb]['lengths']
-        psi = input_unit['thermalBridges'][tb]['psi']
-        for this_id,length in enumerate(lengths):
+    for bridge in input_unit.thermal_bridges:
+        tb = bridge.code
+        name = TBs[tb]
+        psi = bridge.psi
+        for this_id,length in enumerate(bridge.lengths):
             thermal_bridge = {}
             thermal_bridge['TypeSource'] = 'IndependentlyAssessed'
             thermal_bridge['Length'] = length
@@ -710,50 +1017,11 @@ def match_xml(input_unit):
     # Output data for the main heating systems
     # These are empty nested items that Elmhurst requires as input
     for mhs in range(2):
-        main_heating_system = assessment[f'MainHeatingSystem{mhs+1}'] = {}
-        main_heating_system['HeatingDataType'] = 'None'
-        main_heating_system['Fraction'] = 0
-        main_heating_system['PcdfIndex'] = 0
-        main_heating_system['BoilerEfficiencyType'] = 'replace_xsi:nul'
-        main_heating_system['EfficiencyWinter'] = 0
-        main_heating_system['EfficiencySummer'] = 0
-        main_heating_system['TestMethod'] = 'replace_xsi:nul'
-        main_heating_system['MHSCtrlPcdfIndex'] = 'replace_xsi:nul'
-        main_heating_system['CompensatorPcdfIndex'] = 'replace_xsi:nul'
-        main_heating_system['HetasApprovedSystem'] = 'false'
-        main_heating_system['FlueType'] = 'replace_xsi:nul'
-        main_heating_system['FanAssistedFlue'] = 'false'
-        main_heating_system['McsCertificate'] = 'false'
-        main_heating_system['Pumped'] = 'replace_xsi:nul'
-        main_heating_system['HeatingPumpAge'] = 'replace_xsi:nul'
-        main_heating_system['OilPumpInside'] = 'false'
-        main_heating_system['HeatEmitter'] = 'replace_xsi:nul'
-        main_heating_system['UnderfloorHeating'] = 'replace_xsi:nul'
-        main_heating_system['CombiType'] = 'replace_xsi:nul'
-        main_heating_system['CombiKeepHotType'] = 'replace_xsi:nul'
-        main_heating_system['CombiStoreType'] = 'replace_xsi:nul'
-        main_heating_system['ElectricCPSUtemperature'] = 'replace_xsi:nul'
-        main_heating_system['FIcase'] = 'replace_xsi:nul'
-        main_heating_system['FIwater'] = 'replace_xsi:nul'
-        main_heating_system['BurnerControl'] = 'replace_xsi:nul'
-        main_heating_system['DelayedStartStat'] = 'false'
-        main_heating_system['FlowTemperature'] = 'replace_xsi:nul'
-        main_heating_system['BoilerInterlock'] = 'false'
-        main_heating_system['StorageHeaters'] = {}
-        main_heating_system['FlowTemperatureValue'] = 'replace_xsi:nul'
-        main_heating_system['SapCode'] = 'replace_xsi:nul'
-        main_heating_system['FuelType'] = 'replace_xsi:nul'
-        main_heating_system['CtrlSapCode'] = 'replace_xsi:nul'
+        assessment[f'MainHeatingSystem{mhs+1}'] = MAIN_HEATING_SYSTEM
 
     # Output data for the secondary heating systems.
     # This is an empty item that Elmhurst requires as input
-    secondary_heating = assessment['SecondaryHeating'] = {}
-    secondary_heating['HeatingDataType'] = 'None'
-    secondary_heating['TestMethod'] = 'replace_xsi:nul'
-    secondary_heating['HetasApprovedSystems'] = 'false'
-    secondary_heating['Efficiency'] = 'replace_xsi:nul'
-    secondary_heating['SapCode'] = 0
-    secondary_heating['FuelType'] = 'replace_xsi:nul'
+    assessment['SecondaryHeating'] = SECONDARY_HEATING
 
     # Output data for community heating
     community_heating = assessment['CommunityHeating'] = {}
@@ -763,10 +1031,11 @@ def match_xml(input_unit):
     community_heating['ChargingLinked'] = 'replace_xsi:nul'
     heat_source = community_heating['HeatSource'] = {}
     # Elmhurst expects 5 heat sources as input
+    unused_heat_source = UNUSED_HEAT_SOURCE.fill(HeatingUse=input_unit['Heating use'])
     for chs in range(5):
-        comm_heat_source = heat_source[f'CommunityHeatSource{chs+1}'] = {}
         # Only inputting into the first heat source, the rest is kept empty
         if chs == 0:
+            comm_heat_source = heat_source[f'CommunityHeatSource{chs+1}'] = {}
             comm_heat_source['Source'] = input_unit['Heating source 1 - source']
             comm_heat_source['Fraction'] = input_unit['Percentage of heat']
             comm_heat_source['FuelType'] = input_unit['Fuel type']
@@ -778,16 +1047,7 @@ def match_xml(input_unit):
             comm_heat_source['CHPFuelFactor'] = 'replace_xsi:nul'
             comm_heat_source['EfficiencyType'] = 'replace_xsi:nul'
         else:
-            comm_heat_source['Source'] = 'None'
-            comm_heat_source['Fraction'] = 'replace_xsi:nul'
-            comm_heat_source['FuelType'] = 'replace_xsi:nul'
-            comm_heat_source['OveralEfficiency'] = 'replace_xsi:nul'
-            comm_heat_source['HeatPowerRatio'] = 'replace_xsi:nul'
-            comm_heat_source['ElectricalEfficiency'] = 'replace_xsi:nul'
-            comm_heat_source['HeatEfficiency'] = 'replace_xsi:nul'
-            comm_heat_source['HeatingUse'] = input_unit['Heating use']
-            comm_heat_source['CHPFuelFactor'] = 'replace_xsi:nul'
-            comm_heat_source['EfficiencyType'] = 'replace_xsi:nul'
+            heat_source[f'CommunityHeatSource{chs+1}'] = unused_heat_source
 
     community_heating['DistributionLossSpaceValue'] = input_unit['Distribution loss']
     community_heating['DistributionLossWaterValue'] = 'replace_xsi:nul'
@@ -800,50 +1060,12 @@ def match_xml(input_unit):
     community_heating['UseNotionalWater'] = 'replace_xsi:nul'
 
     # Output data for water heating systems DHW
-    water_heating_system = assessment['WaterHeatingSystem'] = {}
-    water_heating_system['WaterHeatingType'] = input_unit['Water heating']
-    water_heating_system['LowWaterUse'] = 'false'
-    water_heating_system['ImmersionHeaterType'] = 'replace_xsi:nul'
-    water_heating_system['SummerImmersion'] = 'false'
-    water_heating_system['SuplementaryImmersion'] = 'false'
-    water_heating_system['ImmersionOnlyHeatingHotWater'] = 'false'
-    water_heating_system['ThermalStore'] = 'None'
-    water_heating_system['ThermalStorePipework'] = 'replace_xsi:nul'
-    water_heating_system['HotWaterCylinder'] = input_unit['Storage type']
-    water_heating_system['InsulationType'] = 'replace_xsi:nul'
-    water_heating_system['InsulationThickness'] = 'replace_xsi:nul'
-    water_heating_system['InsulationThicknessType'] = 'replace_xsi:nul'
-    water_heating_system['Volume'] = 'replace_xsi:nul'
-    water_heating_system['CylinderStat'] = 'false'
-    water_heating_system['PipeworkInsulation'] = 'replace_xsi:nul'
-    water_heating_system['InHeatedSpace'] = 'false'
-    water_heating_system['InAiringCupboard'] = 'false'
-    water_heating_system['SeparateTimeControl'] = 0
-    water_heating_system['LossFactor'] = 1.46
-    water_heating_system['SolarPanelType'] = 'replace_xsi:nul'
-    water_heating_system['SolarAreaType'] = 'Aperture'
-    water_heating_system['SolarArea'] = 0
-    water_heating_system['SolarNi'] = 0
-    water_heating_system['SolarA1'] = 0
-    water_heating_system['SolarA2'] = 0
-    water_heating_system['SolarAGRatio'] = 0
-    water_heating_system['SolarLoopEfficiency'] = 0.9
-    water_heating_system['SolarKhem'] = 0
-    water_heating_system['SolarHeatLossCoeff'] = 'replace_xsi:nul'
-    water_heating_system['SolarIsFromCommunity'] = 'false'
-    water_heating_system['SolarServiceProvision'] = 'replace_xsi:nul'
-    water_heating_system['SolarPanelOrientation'] = 'replace_xsi:nul'
-    water_heating_system['SolarElevation'] = 'replace_xsi:nul'
-    water_heating_system['SolarOvershadingType'] = 'replace_xsi:nul'
-    water_heating_system['SolarVolume'] = 'replace_xsi:nul'
-    water_heating_system['SolarPumpElectricallyPowered'] = 'false'
-    water_heating_system['SolarCombinedCylinder'] = 'false'
-    water_heating_system['ColdWaterSource'] = input_unit['Cold water source']
-    water_heating_system['BathCount'] = int(input_unit['Bath count'])
-    water_heating_system['WWHRSBathCount'] = 'replace_xsi:nul'
-    water_heating_system['SapCode'] = 901
-    water_heating_system['FuelType'] = 'replace_xsi:nul'
-    water_heating_system['HIUPcdfIndex'] = 'replace_xsi:nul'
+    assessment['WaterHeatingSystem'] = WATER_HEATING_SYSTEM.fill(
+        WaterHeatingType=input_unit['Water heating'],
+        HotWaterCylinder=input_unit['Storage type'],
+        ColdWaterSource=input_unit['Cold water source'],
+        BathCount=int(input_unit['Bath count'])
+    )
 
     # Output data for showers (only one shower item is exported)
     showers = assessment['Showers'] = {}
@@ -870,78 +1092,30 @@ def match_xml(input_unit):
     assessment['IATSTestDate'] = 'replace_xsi:nul'
     assessment['ExportCapableMeter'] = 'false'
     assessment['ShowSpaceHeatDemand'] = 'replace_xsi:nul'
-    plot = output_data['Plot'] = {}
-    plot['Reference'] = input_unit['propertyName']
-    plot['TypeReference'] = input_unit['propertyName']
-    plot['RegsRegion'] = 'England'
-    plot['Region'] = 'Thames'
-    plot['HouseName'] = []
-    plot['HouseNumber'] = []
-    plot['Postcode'] = []
-    plot['Street'] = []
-    plot['Town'] = []
-    plot['County'] = []
-    plot['ClientId'] = 'replace_xsi:nul'
-    plot['UPRN'] = []
-    plot['AddressLine1'] = []
-    plot['AddressLine2'] = []
-    plot['AddressLine3'] = []
-    plot['TownAsDesigned'] = []
-    plot['PostcodeAsDesigned'] = []
-    plot['AssessorId'] = '47929'
-    plot['Id'] = '231765'
-    plot['GroupId'] = '32079'
-    plot['SubGroupId'] = 'replace_xsi:nul'
-    plot['AssessorCode'] = []
-    plot['AssessorTitle'] = []
-    plot['AssessorName'] = []
-    plot['AssessorSurname'] = []
+    output_data['Plot'] = PLOT.fill(Reference=input_unit['propertyName'], TypeReference=input_unit['propertyName'])
 
     return output_data
 
-def find_and_replace(file_path, value = 'replace_xsi:nul'):
-    """Writes XML Data Out"""
-    with open(file_path, 'r', encoding="utf-8") as file:
-        xml_data = file.read()
-        root = ET.fromstring(xml_data)
-        # Add root attributes
-        root.set("xmlns:xsd", "http://www.w3.org/2001/XMLSchema")
-        root.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
-        # Traverse XML and check if values match the flag string. 
-        # If they do, remove it and add string as tag attribute
-        def traverse(element):
-            if element.text == value:
-                old_tag = element.tag
-                element.tag = f'{old_tag} xsi:nil="true"'
-                element.text = ''
-            # Check for integers in tags and remove them
-            text = str(element.tag)
-            for test_text in ['Measurement']:
-                for i in range(10):
-                    if text == test_text+str(i):
-                        element.tag = test_text
-            for test_text in [
-                    'ExternalWall',
-                    'PartyWall',
-                    'ExternalRoof',
-                    'HeatLossFloor',
-                    'Floor',
-                    'Roof',
-                    'OpeningType',
-                    'Opening'
-                ]:
-                for i in range(20):
-                    if text == test_text+str(i):
-                        element.tag = test_text
-            for test_text in ['CommunityHeatSource']:
-                for i in range(5):
-                    if text == test_text+str(i+1):
-                        element.tag = test_text
-            # check_tb = ['ThermalBridgesCalculation','ThermalBridgesYvalue']
-            if 'ThermalBridge-' in text:
-                element.tag = 'ThermalBridge'
-            for child in element:
-                traverse(child)
-        traverse(root)
-        updated_xml_data = ET.tostring(root, encoding='utf-8', method='xml').decode()
+def find_and_replace(xml_data, value = 'replace_xsi:nul'):
+    """Writes XML Data Out from the prettified XML string, without touching the disk"""
+    root = ET.fromstring(xml_data)
+    # Add root attributes
+    root.set("xmlns:xsd", "http://www.w3.org/2001/XMLSchema")
+    root.set("xmlns:xsi", "http://www.w3.org/2001/XMLSchema-instance")
+    # Traverse XML and check if values match the flag string. 
+    # If they do, remove it and add string as tag attribute
+    def traverse(element):
+        # Check for integers in tags and remove them, whatever the number of elements
+        element.tag = xml_tag(element.tag)
+        if element.text == value:
+            element.tag = f'{element.tag} xsi:nil="true"'
+            element.text = ''
+        for child in element:
+            traverse(child)
+    traverse(root)
+    updated_xml_data = ET.tostring(root, encoding='utf-8', method='xml').decode()
     return updated_xml_data
+
+def legacy_xml(dictionary):
+    """Runs the original data_to_xml -> prettify -> find_and_replace chain in memory"""
+    return find_and_replace(prettify(data_to_xml(dictionary)))
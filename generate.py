@@ -1,58 +1,253 @@
 """Holds Class for generating the output"""
 
+import csv
+import multiprocessing
 import warnings
+from contextlib import nullcontext
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import StringIO
+from itertools import tee
 import pandas as pd
-import os
-import streamlit as st
-from functions import input_reader, match_xml, data_to_xml, prettify, find_and_replace, generate_unique_name, delete_files_in_directory
+from functions import input_reader, match_xml, emit_xml, thermal_bridge_totals, INPUT_COLUMNS, TB_CODES, ErrorFound
+from validation import validate_sheet, InvalidCalcSheet
+from cache import unit_key
+from profiling import Profiler, measure
+from schema import check_xml
 
 warnings.simplefilter(action='ignore', category=UserWarning)
 
 class SAP:
     """The main Class for handling the inputs and outputs"""
-    def __init__(self, sheet, name):
+    def __init__(self, sheet, name, profiler=None, schema=None):
         self.sheet = sheet
         self.name = name
-        self.input_unit = input_reader(self.sheet)
-        self.output_data = match_xml(self.input_unit)
+        self.profiler = profiler
+        self.xml_out = None
+        self.thermal_bridges = None
+        # Every problem in the sheet is collected first, nothing is generated if there is any
+        with measure(profiler, 'validate', name):
+            self.problems = validate_sheet(self.sheet, self.name)
+        if self.problems:
+            return
+        with measure(profiler, 'input_reader', name):
+            self.input_unit = input_reader(self.sheet)
+            self.thermal_bridges = thermal_bridge_totals(self.input_unit)
+        with measure(profiler, 'match_xml', name):
+            self.output_data = match_xml(self.input_unit)
         if self.output_data:
             self.writer()
-            self.remove_temp_files()
         else:
-            raise st.error('No output data')
+            raise ErrorFound('No output data')
+        if schema is not None:
+            with measure(profiler, 'schema', name):
+                self.problems = check_xml(self.xml_out, self.name, schema)
 
     def writer(self):
-        """Writes out the xml data to a file"""
-        xml_string = data_to_xml(self.output_data)
-        temp_file_name = generate_unique_name(self.name)
-        
-        self.temp_path = './temp/'
-        if not os.path.exists(self.temp_path):
-            os.makedirs(self.temp_path)
-
-        file_path = f'{self.temp_path}/{temp_file_name}.xml'
-        with open(file_path,'w', encoding="utf-8") as f:
-            try:
-                f.write(prettify(xml_string))
-                self.xml_out = find_and_replace(file_path)
-            except Exception as exc:
-                raise st.error('Invalid XML structure') from exc
-        pass
-
-    def remove_temp_files(self):
-        """Removes all temp files"""
-        delete_files_in_directory(self.temp_path)
-        pass
-
-def generate(file):
-    excel_path = file
-    print('SAP Calc Sheet: '+excel_path.name)
-    df = pd.read_excel(excel_path, header=1, sheet_name=None)
-    units_xmls = []
-    units_names = []
-    for this_name, this_sheet in df.items():
-        if 'Unit' in this_name:
-            sap = SAP(this_sheet,this_name)
-            units_xmls.append(sap.xml_out)
-            units_names.append(sap.name)
+        """Writes out the xml data in a single pass"""
+        try:
+            with measure(self.profiler, 'serialize', self.name):
+                self.xml_out = emit_xml(self.output_data)
+        except Exception as exc:
+            raise ErrorFound('Invalid XML structure') from exc
+
+def build_unit(unit, profile=False, schema=None):
+    """Runs the validate -> input_reader -> match_xml -> serialize pipeline for one (name, sheet) pair,
+    then checks the XML against the XSD at `schema` if one is given.
+    Returns (name, xml, problems, profile records, thermal bridge totals), the records being empty unless
+    profile is set"""
+    name, sheet = unit
+    with Profiler() if profile else nullcontext() as profiler:
+        sap = SAP(sheet, name, profiler, schema)
+    return sap.name, sap.xml_out, sap.problems, profiler.records if profile else [], sap.thermal_bridges
+
+def check_unit(unit):
+    """Validates one (name, sheet) pair without generating any XML"""
+    name, sheet = unit
+    return validate_sheet(sheet, name)
+
+def process_context():
+    """Start method of the worker processes. The pools are started from threads of the Streamlit server, so their
+    processes come from a fork server (spawned where there is none) rather than a fork of the threaded server"""
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+def map_units(function, units, workers=1, pool=None):
+    """Yields function of each (name, sheet) pair in sheet order, on a process pool when workers > 1 or one is given.
+    A given pool is shared with other callers and left open, and at most `workers` units are in flight on it, so
+    workers is this caller's share of the pool. On its own pool, 2 units per worker are in flight to keep it busy.
+    units is consumed lazily, so memory does not grow with the workbook"""
+    if workers > 1 or pool is not None:
+        window = workers if pool is not None else workers * 2
+        with (nullcontext(pool) if pool is not None
+              else ProcessPoolExecutor(max_workers=workers, mp_context=process_context())) as executor:
+            # Results are taken from the front of the queue, so names stay deterministic
+            pending = deque()
+            for unit in units:
+                pending.append(executor.submit(function, unit))
+                if len(pending) >= window:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    else:
+        for unit in units:
+            yield function(unit)
+
+class ParsedWorkbook:
+    """A Calc Sheet whose Unit sheets have already been read. It can be passed wherever a file is.
+    records holds the profile of the read, if it was profiled"""
+    def __init__(self, name, sheets, records=()):
+        self.name = name
+        self.sheets = sheets
+        self.records = list(records)
+
+def parse_workbook(file, profiler=None):
+    """Reads every Unit sheet of the Calc Sheet once, for reuse by later validate or generate calls.
+    With a profiler, the open workbook and read stages are recorded and kept on the ParsedWorkbook"""
+    sheets = dict(read_units(file, profiler=profiler))
+    return ParsedWorkbook(source_name(file), sheets, profiler.records if profiler is not None else ())
+
+def source_name(file):
+    """Name of the Calc Sheet, whether it is an uploaded file or a path"""
+    return getattr(file, 'name', str(file))
+
+def list_units(file):
+    """Lists the Unit sheet names without parsing any sheet"""
+    if isinstance(file, ParsedWorkbook):
+        return list(file.sheets)
+    with pd.ExcelFile(file) as excel:
+        return [name for name in excel.sheet_names if 'Unit' in name]
+
+def select_units(names, units):
+    """Keeps the Unit sheets listed in units, in sheet order, or all of them when units is None"""
+    if units is None:
+        return names
+    missing = [name for name in units if name not in names]
+    if missing:
+        raise ErrorFound(f'Unit sheet(s) not found in the Calc Sheet: {", ".join(missing)}')
+    return [name for name in names if name in units]
+
+def read_units(file, units=None, profiler=None):
+    """Yields (name, sheet) for the selected Unit sheets, reading only the columns input_reader uses"""
+    if isinstance(file, ParsedWorkbook):
+        for name in select_units(list(file.sheets), units):
+            yield name, file.sheets[name]
+        return
+    with measure(profiler, 'open workbook'):
+        excel = pd.ExcelFile(file)
+    with excel:
+        for name in select_units([name for name in excel.sheet_names if 'Unit' in name], units):
+            with measure(profiler, 'read', name):
+                sheet = excel.parse(name, header=1, usecols=lambda col: col in INPUT_COLUMNS)
+            yield name, sheet
+
+def validate(file, workers=1, units=None, pool=None):
+    """Checks every Unit sheet (or just `units`) without generating XML and returns all the problems found.
+    pool is a process pool shared with other callers, see map_units"""
+    print('SAP Calc Sheet: '+source_name(file))
+    reports = map_units(check_unit, read_units(file, units), workers, pool)
+    return [problem for report in reports for problem in report]
+
+def iter_generate(file, workers=1, units=None, cache=None, profiler=None, pool=None, schema=None, totals=None):
+    """Yields (name, xml, problems) for every Unit sheet (or just `units`) in sheet order, as soon as each is ready.
+    With an XSD path as schema, each XML is checked against it and any schema error is one of the unit's problems.
+    With an XMLCache, units whose relevant cells have not changed are taken from the cache.
+    With a Profiler, the stages of every unit are recorded on it, including those run in worker processes.
+    With a list as totals, the thermal_bridge_totals of every unit without problems are appended to it.
+    Sheets are read one at a time and dropped once built, so only the units in flight are held in memory"""
+    print('SAP Calc Sheet: '+source_name(file))
+    def look_up(units):
+        for name, sheet in units:
+            key = xml = unit_totals = None
+            if cache is not None:
+                with measure(profiler, 'cache lookup', name):
+                    key = unit_key(sheet)
+                    xml = cache.get(key)
+                # Only the XML is cached, the totals of a cached unit are read again from its sheet
+                if xml is not None and totals is not None:
+                    with measure(profiler, 'thermal bridges', name):
+                        unit_totals = thermal_bridge_totals(input_reader(sheet))
+            # The sheet of a cached unit is not needed any more
+            yield name, sheet if xml is None else None, key, xml, unit_totals
+    # The builders read ahead of the results by at most the units in flight
+    to_build, in_order = tee(look_up(read_units(file, units, profiler)))
+    builder = partial(build_unit, profile=profiler is not None, schema=schema)
+    built = map_units(builder, ((name, sheet) for name, sheet, _, xml, _ in to_build if xml is None), workers, pool)
+    for name, _, key, xml, unit_totals in in_order:
+        if xml is not None:
+            # The cache does not know which schema, if any, the XML was checked against
+            problems = []
+            if schema is not None:
+                with measure(profiler, 'schema', name):
+                    problems = check_xml(xml, name, schema)
+            if totals is not None and not problems:
+                totals.append(unit_totals)
+            yield name, xml, problems
+            continue
+        name, xml, problems, records, unit_totals = next(built)
+        if profiler is not None:
+            profiler.records.extend(records)
+        if totals is not None and not problems:
+            totals.append(unit_totals)
+        if cache is not None and not problems:
+            cache.put(key, xml)
+        yield name, xml, problems
+
+def raise_problems(problems):
+    """Raises a single error listing every problem found in the Calc Sheet"""
+    if problems:
+        raise InvalidCalcSheet(problems)
+
+def generate(file, workers=1, units=None, cache=None, profiler=None, schema=None):
+    """Generates the XML for every Unit sheet (or just `units`), spreading them over `workers` processes.
+    Every XML is returned at once, use generate_zip or iter_generate to keep memory flat on large workbooks"""
+    results = list(iter_generate(file, workers, units, cache, profiler, schema=schema))
+    raise_problems([problem for _, _, unit_problems in results for problem in unit_problems])
+    units_names = [name for name, _, _ in results]
+    units_xmls = [xml for _, xml, _ in results]
     return units_names,units_xmls
+
+def totals_csv(totals):
+    """Formats thermal_bridge_totals rows as CSV, one row per unit with a column per junction"""
+    text = StringIO()
+    writer = csv.DictWriter(text, fieldnames=['unit', 'htb_w_k', 'exposed_area_m2', 'y_value_w_m2k', *TB_CODES],
+                            lineterminator='\n')
+    writer.writeheader()
+    # Rounded, so the sums do not show floating point noise
+    writer.writerows({column: round(value, 4) if isinstance(value, float) else value for column, value in row.items()}
+                     for row in totals)
+    return text.getvalue()
+
+# File the thermal bridge totals are written to, next to the unit XMLs
+TOTALS_FILE = 'Thermal bridges.csv'
+
+def generate_files(file, write, workers=1, units=None, cache=None, profiler=None, progress=None, pool=None,
+                   schema=None, thermal_bridges=False):
+    """Calls write(file name, bytes) with each unit's XML as soon as it is ready, so only one unit's XML is held
+    at a time. progress, if given, is called with each unit name once it is done.
+    With thermal_bridges set, the thermal bridge totals of every unit are written last as TOTALS_FILE.
+    Returns the names of the units written"""
+    names = []
+    problems = []
+    totals = [] if thermal_bridges else None
+    for name, xml, unit_problems in iter_generate(file, workers, units, cache, profiler, pool, schema, totals):
+        problems.extend(unit_problems)
+        if not problems:
+            with measure(profiler, 'write', name):
+                write(f'{name}.xml', xml.encode('utf-8'))
+            names.append(name)
+        if progress is not None:
+            progress(name)
+    if totals and not problems:
+        write(TOTALS_FILE, totals_csv(totals).encode('utf-8'))
+    raise_problems(problems)
+    return names
+
+def generate_zip(file, archive, workers=1, units=None, cache=None, profiler=None, progress=None, pool=None,
+                 schema=None, thermal_bridges=False):
+    """Writes each unit's XML into a ZIP archive on the `archive` file object, see generate_files"""
+    with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        return generate_files(file, zip_file.writestr, workers, units, cache, profiler, progress, pool, schema,
+                              thermal_bridges)
@@ -0,0 +1,195 @@
+"""Background generation jobs, so the work outlives the Streamlit run and the browser tab that started it"""
+
+import os
+import tempfile
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait
+from io import BytesIO
+from threading import Lock
+from functions import ErrorFound
+from generate import generate_files, list_units, source_name, process_context, ParsedWorkbook
+from profiling import Profiler, measure
+from validation import InvalidCalcSheet
+
+def archive_folders(workbook_names):
+    """Names the archive folder of each Calc Sheet after its file, numbering any repeated name"""
+    folders = []
+    for name in workbook_names:
+        stem = os.path.splitext(os.path.basename(name))[0]
+        folder = stem
+        copy = 1
+        while folder in folders:
+            copy += 1
+            folder = f'{stem} ({copy})'
+        folders.append(folder)
+    return folders
+
+class Job:
+    """One or more Calc Sheets being turned into a single ZIP of XMLs.
+    Its fields are updated by the worker threads as units and workbooks finish"""
+    def __init__(self, files, units, workers, profiler, schema=None, thermal_bridges=False):
+        self.id = uuid.uuid4().hex
+        self.files = files
+        self.file_name = source_name(files[0]) if len(files) == 1 else f'{len(files)} Calc Sheets'
+        self.units = units
+        self.workers = workers
+        self.profiler = profiler
+        self.schema = schema
+        self.thermal_bridges = thermal_bridges
+        self.status = 'queued'
+        self.total = 0
+        self.done = []
+        # One status row per Calc Sheet, in upload order
+        self.workbooks = [
+            {'workbook': source_name(file), 'status': 'queued', 'units': None, 'done': 0, 'problems': 0,
+             'error': None, 'seconds': None}
+            for file in files
+        ]
+        self.archive = None
+        self.error = None
+        self.problems = []
+        self.created = time.time()
+        self.finished = None
+
+    @property
+    def running(self):
+        return self.status in ('queued', 'running')
+
+    @property
+    def progress(self):
+        """Share of the units done, from 0 to 1"""
+        return len(self.done) / self.total if self.total else 0.0
+
+class JobManager:
+    """Runs jobs on background threads and keeps finished ones for `keep_for` seconds so they can be downloaded.
+    The Calc Sheets of a job are processed concurrently, and the units of every job share one process pool"""
+    def __init__(self, max_jobs=2, max_workbooks=4, processes=None, keep_for=3600, cache=None):
+        self.cache = cache
+        self.keep_for = keep_for
+        self.processes = processes or os.cpu_count() or 1
+        self._jobs = {}
+        self._lock = Lock()
+        self._job_threads = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='sap-job')
+        self._workbook_threads = ThreadPoolExecutor(max_workers=max_workbooks, thread_name_prefix='sap-workbook')
+        self._pool = None
+
+    @property
+    def pool(self):
+        """The process pool shared by every job, started on first use. None when there is a single process"""
+        if self._pool is None and self.processes > 1:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=process_context())
+        return self._pool
+
+    def submit(self, files, units=None, workers=1, profiler=None, schema=None, thermal_bridges=False):
+        """Queues the Calc Sheets (paths, file objects or ParsedWorkbooks) and returns the job id.
+        units only applies when there is a single Calc Sheet. schema is the path of an XSD to check every XML against.
+        With thermal_bridges set, each Calc Sheet's thermal bridge totals are added to the ZIP as a CSV"""
+        self.prune()
+        if not isinstance(files, (list, tuple)):
+            files = [files]
+        job = Job(list(files), units if len(files) == 1 else None, workers, profiler, schema, thermal_bridges)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._job_threads.submit(self._run, job)
+        return job.id
+
+    def get(self, job_id):
+        """Returns the job, or None if it is unknown or has expired.
+        Expired jobs are also forgotten here, so their archives are freed even when no new job is submitted"""
+        self.prune()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def prune(self):
+        """Forgets the jobs that finished more than keep_for seconds ago"""
+        cutoff = time.time() - self.keep_for
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items() if job.finished and job.finished < cutoff]:
+                del self._jobs[job_id]
+
+    def _run(self, job):
+        """Generates every Calc Sheet of the job at once, then gathers them into one ZIP, a folder per Calc Sheet"""
+        job.status = 'running'
+        archive = BytesIO()
+        archive_lock = Lock()
+        try:
+            readable = []
+            folders = archive_folders([status['workbook'] for status in job.workbooks])
+            for file, status, folder in zip(job.files, job.workbooks, folders):
+                try:
+                    status['units'] = len(job.units or list_units(file))
+                except Exception as exc:
+                    status['status'] = 'failed'
+                    status['error'] = f'The file could not be read as a Calc Sheet: {exc}'
+                else:
+                    readable.append((file, status, folder))
+            job.total = sum(status['units'] for _, status, _ in readable)
+            # A single Calc Sheet keeps the flat layout of a one-workbook download
+            with zipfile.ZipFile(archive, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+                wait([
+                    self._workbook_threads.submit(self._run_workbook, job, file, status, zip_file, archive_lock,
+                                                  folder if len(job.files) > 1 else '')
+                    for file, status, folder in readable
+                ])
+        except Exception as exc:
+            job.error = f'Unexpected error: {exc}'
+            job.status = 'failed'
+        else:
+            failed = [status for status in job.workbooks if status['status'] != 'done']
+            if len(failed) == len(job.workbooks):
+                job.status = 'failed'
+                job.error = '; '.join(status['error'] for status in failed if status['error'])
+            else:
+                job.archive = archive
+                job.status = 'done'
+        finally:
+            # The uploads are not needed once the job is over
+            job.files = None
+            job.finished = time.time()
+
+    def _run_workbook(self, job, file, status, zip_file, archive_lock, folder):
+        """Generates one Calc Sheet into the job's archive under `folder`. The XMLs are staged in a temporary
+        folder and only added to the archive once the whole workbook is done, so a failed one leaves nothing"""
+        status['status'] = 'running'
+        start = time.perf_counter()
+        profiler = Profiler(job.profiler.memory) if job.profiler is not None else None
+        if profiler is not None and isinstance(file, ParsedWorkbook):
+            # The Calc Sheet was read before the job, e.g. on upload
+            profiler.records.extend(file.records)
+        prefix = f'{folder}/' if folder else ''
+        def progress(name):
+            status['done'] += 1
+            job.done.append(prefix + name)
+        try:
+            with tempfile.TemporaryDirectory(prefix='sap-xml-') as staging:
+                staged = []
+                def stage(file_name, data):
+                    with open(os.path.join(staging, file_name), 'wb') as staged_file:
+                        staged_file.write(data)
+                    staged.append(file_name)
+                generate_files(file, stage, workers=min(job.workers, self.processes), units=job.units,
+                               cache=self.cache, profiler=profiler, progress=progress, pool=self.pool,
+                               schema=job.schema, thermal_bridges=job.thermal_bridges)
+                with archive_lock, measure(profiler, 'zip'):
+                    for file_name in staged:
+                        zip_file.write(os.path.join(staging, file_name), prefix + file_name)
+            status['status'] = 'done'
+        except InvalidCalcSheet as exc:
+            status['status'] = 'failed'
+            status['problems'] = len(exc.problems)
+            job.problems.extend({'workbook': status['workbook'], **problem} for problem in exc.problems)
+        except ErrorFound as exc:
+            status['status'] = 'failed'
+            status['error'] = str(exc)
+        except Exception as exc:
+            status['status'] = 'failed'
+            status['error'] = f'Unexpected error: {exc}'
+        finally:
+            status['seconds'] = round(time.perf_counter() - start, 2)
+            if profiler is not None:
+                profiler.stop()
+                job.profiler.records.extend({'workbook': status['workbook'], **record} for record in profiler.records)
@@ -0,0 +1,69 @@
+"""Compact, typed model of one unit sheet, as built by input_reader. Only the entered rows are kept"""
+
+from typing import NamedTuple, Optional
+
+class Level(NamedTuple):
+    """One storey, in sheet order"""
+    floor_to_slab: float
+    heated_area: float
+    heat_loss_perimeter: float
+
+class OpaqueElement(NamedTuple):
+    """One opaque element. Inputs the element type does not use are None.
+    Walls also carry the area of the openings placed on them and their net area"""
+    row: int
+    level: Optional[float]
+    type: str
+    name: str
+    area: Optional[float]
+    u_value: Optional[float]
+    shelter_factor: Optional[float]
+    construction_type: Optional[str]
+    openings_area: Optional[float]
+    net_area: Optional[float]
+    complete: bool
+
+class OpeningType(NamedTuple):
+    """One opening type. row is its position in the sheet, which Elmhurst uses as the OpeningTypeIndex"""
+    row: int
+    name: Optional[str]
+    type: Optional[str]
+    glazing_type: Optional[str]
+    u_value: Optional[float]
+    solar_transmittance: Optional[float]
+    frame_factor: Optional[float]
+
+class Opening(NamedTuple):
+    """One opening, placed on an external or sheltered wall"""
+    row: int
+    level: Optional[float]
+    name: Optional[str]
+    type: Optional[str]
+    parent: Optional[str]
+    orientation: Optional[str]
+    area: Optional[float]
+
+class ThermalBridge(NamedTuple):
+    """The psi value of one junction, the lengths entered for it and its heat loss, the sum of L·ψ in W/K"""
+    code: str
+    psi: float
+    lengths: tuple
+    heat_loss: float
+
+class Unit:
+    """One unit sheet. The single-value inputs are read with unit['header'], the sections are tuples of records"""
+    __slots__ = ('name', 'values', 'levels', 'opaque_elements', 'opening_types', 'openings', 'thermal_bridges')
+
+    def __init__(self, name, values, levels, opaque_elements, opening_types, openings, thermal_bridges):
+        self.name = name
+        self.values = values
+        self.levels = levels
+        self.opaque_elements = opaque_elements
+        self.opening_types = opening_types
+        self.openings = openings
+        self.thermal_bridges = thermal_bridges
+
+    def __getitem__(self, header):
+        if header == 'propertyName':
+            return self.name
+        return self.values[header]
@@ -0,0 +1,113 @@
+"""Optional per-stage, per-unit timing and memory records of the XML generation"""
+
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from threading import Lock
+
+# tracemalloc is global to the process, while profilers run on several threads at once. Tracing is kept on for as
+# long as any profiler uses it, and the stages running at any moment are tracked, each with whether another
+# stage overlapped it
+_lock = Lock()
+_users = 0
+_started_tracing = False
+_running = {}
+
+def _acquire_tracing():
+    """Counts one more profiler using tracemalloc, starting it for the first one unless it is already on"""
+    global _users, _started_tracing
+    with _lock:
+        _users += 1
+        if _users == 1 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+
+def _release_tracing():
+    """Counts one profiler less, stopping tracemalloc after the last one if a profiler started it"""
+    global _users, _started_tracing
+    with _lock:
+        _users -= 1
+        if _users == 0 and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+class Profiler:
+    """Records wall time, CPU time and peak traced memory of each stage, per unit.
+    The peak is only kept for stages that ran alone in the process, as the memory of stages running side by side
+    on other threads cannot be told apart. Used as a context manager, it releases the memory tracing on exit"""
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.records = []
+        self._tracing = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def start(self):
+        """Starts tracing memory now rather than at the first stage"""
+        if self.memory and not self._tracing:
+            _acquire_tracing()
+            self._tracing = True
+
+    def stop(self):
+        """Releases the memory tracing, which stops once no profiler uses it"""
+        if self._tracing:
+            _release_tracing()
+            self._tracing = False
+
+    @contextmanager
+    def stage(self, stage, unit=''):
+        """Records one run of a stage. Stages are not nested, so the memory peak is the stage's own"""
+        self.start()
+        token = object()
+        if self.memory:
+            with _lock:
+                # Resetting the peak spoils that of the stages already running, and theirs spoil this one
+                overlapped = bool(_running)
+                for other in _running:
+                    _running[other] = True
+                _running[token] = overlapped
+                tracemalloc.reset_peak()
+                held = tracemalloc.get_traced_memory()[0]
+        wall = time.perf_counter()
+        cpu = time.thread_time()
+        try:
+            yield
+        finally:
+            peak_mb = None
+            if self.memory:
+                with _lock:
+                    if not _running.pop(token):
+                        peak_mb = (tracemalloc.get_traced_memory()[1] - held) / 2**20
+            record = {
+                'unit': unit,
+                'stage': stage,
+                'wall_s': time.perf_counter() - wall,
+                'cpu_s': time.thread_time() - cpu,
+                'peak_mb': peak_mb
+            }
+            self.records.append(record)
+
+    def totals(self):
+        """Sums the records per stage, in the order the stages first ran, with the slowest unit of each"""
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(record['stage'], {'stage': record['stage'], 'wall_s': 0, 'cpu_s': 0,
+                                                        'peak_mb': None, 'runs': 0, 'slowest_unit': '',
+                                                        'slowest_s': 0})
+            total['wall_s'] += record['wall_s']
+            total['cpu_s'] += record['cpu_s']
+            total['runs'] += 1
+            if record['peak_mb'] is not None:
+                total['peak_mb'] = max(total['peak_mb'] or 0, record['peak_mb'])
+            if record['wall_s'] >= total['slowest_s']:
+                total['slowest_unit'] = record['unit']
+                total['slowest_s'] = record['wall_s']
+        return list(totals.values())
+
+def measure(profiler, stage, unit=''):
+    """Records the stage with profiler, or does nothing when profiling is off"""
+    return profiler.stage(stage, unit) if profiler is not None else nullcontext()
@@ -0,0 +1,33 @@
+"""Optional check of the generated XML against a locally supplied Elmhurst XSD. Needs lxml, which is only
+imported when a schema is given"""
+
+from functools import lru_cache
+from threading import Lock
+from functions import ErrorFound
+
+@lru_cache(maxsize=4)
+def load_schema(path):
+    """Parses and compiles the XSD at path. It is done once per process, every later unit reuses the result"""
+    try:
+        from lxml import etree
+    except ImportError as exc:
+        raise ErrorFound('Checking the XML against an XSD needs lxml (pip install lxml)') from exc
+    try:
+        return etree.XMLSchema(etree.parse(path))
+    except (OSError, etree.XMLSyntaxError, etree.XMLSchemaParseError) as exc:
+        raise ErrorFound(f'The XSD {path} could not be loaded: {exc}') from exc
+
+# A compiled schema keeps the errors of its last validate in error_log, so threads sharing it take turns
+_validate_lock = Lock()
+
+def check_xml(xml, name, path):
+    """Returns the schema errors of one unit's XML as problems, none when the XML is valid"""
+    from lxml import etree
+    schema = load_schema(path)
+    document = etree.fromstring(xml.encode('utf-8'))
+    with _validate_lock:
+        if schema.validate(document):
+            return []
+        errors = list(schema.error_log)
+    return [{'unit': name, 'section': 'Schema', 'problem': f'Line {error.line}: {error.message}'}
+            for error in errors] or [{'unit': name, 'section': 'Schema', 'problem': 'Rejected by the XSD'}]
@@ -0,0 +1,115 @@
+"""Builds synthetic Calc Sheets from the standard template, at any size, for benchmarks and checks"""
+
+import itertools
+import openpyxl
+from TBs import TBs
+from functions import OPAQUE_COLUMNS, WALL_TYPES
+
+TEMPLATE = 'CALC-XX-XX-SAP CALC TEMPLATE.xlsx'
+
+# Excel rows of the template unit sheet: headers, thermal bridge psi values, then the data
+HEADER_ROW = 2
+FIRST_ROW = 4
+
+def header_columns(sheet):
+    """Maps each header to its column number, keeping the first of any repeated header as pandas does"""
+    columns = {}
+    for cell in sheet[HEADER_ROW]:
+        if cell.value is not None:
+            columns.setdefault(cell.value, cell.column)
+    return columns
+
+def template_rows(sheet, columns, key):
+    """Reads the populated template rows of a section, as lists of values over `columns`"""
+    rows = []
+    for row in range(FIRST_ROW, sheet.max_row + 1):
+        if sheet.cell(row, key).value is not None:
+            rows.append([sheet.cell(row, column).value for column in columns])
+    return rows
+
+def clear(sheet, columns, first_row):
+    """Empties the section columns from first_row down"""
+    for row in range(first_row, sheet.max_row + 1):
+        for column in columns:
+            sheet.cell(row, column).value = None
+
+def fill_opaque_elements(sheet, columns, count):
+    """Writes `count` opaque elements by repeating the template ones under new names. Returns the wall names"""
+    section = list(range(columns[OPAQUE_COLUMNS[0]], columns[OPAQUE_COLUMNS[-1]] + 1))
+    type_at = section.index(columns['Element type'])
+    name_at = section.index(columns['Element name'])
+    rows = template_rows(sheet, section, columns['Element type'])
+    clear(sheet, section, FIRST_ROW)
+    walls = []
+    for i, row in zip(range(count), itertools.cycle(rows)):
+        row = list(row)
+        row[name_at] = f'{row[name_at]} ({i + 1})'
+        if row[type_at] in WALL_TYPES:
+            walls.append(row[name_at])
+        for column, value in zip(section, row):
+            sheet.cell(FIRST_ROW + i, column).value = value
+    return walls
+
+def fill_openings(sheet, columns, count, walls):
+    """Writes `count` openings by repeating the template ones, spread over the walls"""
+    section = list(range(columns['Opening level ref.'], columns['Floor to ceiling?'] + 1))
+    name_at = section.index(columns['Opening name'])
+    parent_at = section.index(columns['Belongs to opaque element'])
+    rows = template_rows(sheet, section, columns['Opening name'])
+    clear(sheet, section, FIRST_ROW)
+    for i, row, wall in zip(range(count), itertools.cycle(rows), itertools.cycle(walls)):
+        row = list(row)
+        row[name_at] = f'{row[name_at]} ({i + 1})'
+        row[parent_at] = wall
+        for column, value in zip(section, row):
+            sheet.cell(FIRST_ROW + i, column).value = value
+
+def fit_walls(sheet, columns):
+    """Enlarges the walls smaller than the openings placed on them, so no wall is left with a negative net area"""
+    placed = {}
+    for row in range(FIRST_ROW, sheet.max_row + 1):
+        parent = sheet.cell(row, columns['Belongs to opaque element']).value
+        area = sheet.cell(row, columns['Area']).value
+        if parent is not None and isinstance(area, (int, float)):
+            placed[parent] = placed.get(parent, 0) + area
+    for row in range(FIRST_ROW, sheet.max_row + 1):
+        kind = sheet.cell(row, columns['Element type']).value
+        name = sheet.cell(row, columns['Element name']).value
+        if kind in WALL_TYPES and name in placed:
+            area = sheet.cell(row, columns[f'{kind} area'])
+            if isinstance(area.value, (int, float)) and area.value < placed[name]:
+                area.value = round(placed[name] * 1.5, 2)
+
+def fill_thermal_bridges(sheet, columns, lengths):
+    """Writes `lengths` lengths under every thermal bridge, below the level reference row"""
+    first_row = FIRST_ROW + 1
+    tb_columns = [columns[tb] for tb in TBs]
+    clear(sheet, tb_columns, first_row)
+    for i in range(lengths):
+        sheet.cell(first_row + i, columns['TB level ref']).value = i % 5 + 1
+        for j, column in enumerate(tb_columns):
+            sheet.cell(first_row + i, column).value = round(1 + (i + j) % 7 * 0.5, 2)
+
+def build_workbook(path, units=1, opaque_elements=None, openings=None, tb_lengths=None, template=TEMPLATE):
+    """Saves a Calc Sheet with `units` copies of the template unit to path.
+    Sections left as None keep the template's own rows"""
+    # Formulas are replaced by their cached values, since openpyxl cannot recalculate them on save
+    workbook = openpyxl.load_workbook(template, data_only=True)
+    sheet = workbook['Unit 1']
+    columns = header_columns(sheet)
+    if opaque_elements is not None:
+        walls = fill_opaque_elements(sheet, columns, opaque_elements)
+    else:
+        walls = [name for name, kind in template_rows(sheet, [columns['Element name'], columns['Element type']],
+                                                      columns['Element type']) if kind in WALL_TYPES]
+    if openings is not None:
+        fill_openings(sheet, columns, openings, walls)
+    fit_walls(sheet, columns)
+    if tb_lengths is not None:
+        fill_thermal_bridges(sheet, columns, tb_lengths)
+    for unit in range(2, units + 1):
+        copy = workbook.copy_worksheet(sheet)
+        copy.title = f'Unit {unit}'
+        copy.cell(FIRST_ROW, columns['Property name']).value = f'Unit {unit}'
+    workbook.save(path)
+    return path
@@ -0,0 +1,190 @@
+"""Checks the unit sheets and collects every problem in one report, instead of stopping at the first"""
+
+import numpy as np
+import pandas as pd
+from TBs import TBs
+from levels_naming import levels_naming
+from functions import (
+    GEN_INFO_LIST,
+    MECH_VENT_LIST,
+    LIGHTING_LIST,
+    HEAT_NETWORKS_LIST,
+    WATER_HEATING_LIST,
+    PV_LIST,
+    LEVEL_COLUMNS,
+    OPAQUE_ELEMENT_TYPES,
+    OPAQUE_ELEMENT_AREAS,
+    OPENING_INPUTS,
+    OPAQUE_REQUIRED,
+    INPUT_COLUMNS,
+    NUMERIC_VALUES,
+    NUMERIC_COLUMNS,
+    WALL_TYPES,
+    opening_areas,
+    wall_openings_areas,
+    ErrorFound
+)
+
+class InvalidCalcSheet(ErrorFound):
+    """Raised with every problem validate_sheet found, so callers can show them all at once"""
+    def __init__(self, problems):
+        super().__init__(f'The Calc Sheet has {len(problems)} problem(s):\n{format_problems(problems)}')
+        self.problems = problems
+
+SINGLE_VALUE_LISTS = {
+    'General information': GEN_INFO_LIST,
+    'Mechanical ventilation': MECH_VENT_LIST,
+    'Lighting': LIGHTING_LIST,
+    'Heat networks': HEAT_NETWORKS_LIST,
+    'Water heating': WATER_HEATING_LIST,
+    'PV': PV_LIST
+}
+
+# Opaque element types exported with a StoreyIndex
+LEVELLED_TYPES = ['External roof', 'Heat loss floor', 'Party ceiling', 'Party floor']
+
+WINDOW_INPUTS = ['Type', 'U-value', 'Solar transmittance', 'Frame factor']
+DOOR_INPUTS = ['Type', 'U-value', 'Frame factor']
+
+def listed_levels(levels):
+    """Flags the level references that match a storey in levels_naming"""
+    storeys = np.trunc(pd.to_numeric(levels, errors='coerce') - 1)
+    return np.isin(storeys, [int(storey) for storey in levels_naming])
+
+def duplicated_names(names):
+    """Returns one name per group of names that are repeated, or only differ by case or surrounding spaces"""
+    keys = names.astype(str).str.strip().str.casefold()
+    return names[keys.duplicated(keep=False) & ~keys.duplicated()].tolist()
+
+def validate_sheet(sheet, name):
+    """Checks one unit sheet with column-wise operations and returns every problem found"""
+    problems = []
+    def add(section, message):
+        problems.append({'unit': name, 'section': section, 'problem': message})
+
+    missing_columns = sorted(INPUT_COLUMNS - set(sheet.columns))
+    if missing_columns:
+        add('Sheet', f'Columns missing from the sheet: {", ".join(missing_columns)}')
+        return problems
+    if len(sheet) < 2:
+        add('Sheet', 'The sheet has no data rows')
+        return problems
+
+    # One pass over the sheet gives the entered cells for every check below
+    rows = sheet.iloc[1:]
+    entered = rows.notna()
+
+    # Single values sit on the first data row
+    first_row = entered.iloc[0]
+    if not first_row['Property name']:
+        add('General information', '"Property name" has not been entered')
+    for section, input_list in SINGLE_VALUE_LISTS.items():
+        for info in first_row[input_list].index[~first_row[input_list].to_numpy()]:
+            add(section, f'"{info}" has not been entered')
+
+    # Numbers stored as text are read as numbers, any other text in a numeric input is a problem.
+    # The thermal bridges are checked further down
+    def not_numbers(cells):
+        return cells.notna() & pd.to_numeric(cells, errors='coerce').isna()
+    values = sheet[NUMERIC_VALUES].iloc[1]
+    if values.get('Wet rooms') is not None and sheet['Mech vent present'].iloc[1] != 'Yes':
+        # Only read when there is mechanical ventilation
+        values = values.drop('Wet rooms')
+    for info in values.index[not_numbers(values.astype(object)).to_numpy()]:
+        add('Numeric inputs', f'"{info}" is not a number: {values[info]}')
+    for column in NUMERIC_COLUMNS:
+        if column in TBs or sheet[column].dtype != object:
+            continue
+        text = sheet[column][not_numbers(sheet[column])]
+        if len(text):
+            add('Numeric inputs', f'"{column}" has entries that are not numbers: {", ".join(map(str, text[:3]))}')
+
+    # Levels
+    levels_count = sheet[LEVEL_COLUMNS].notna().sum()
+    if levels_count.nunique() > 1:
+        add('Levels', 'One or multiple inputs among ["Floor to slab", "Heat loss perimeter", '
+                      '"Heated internal area"] have not been entered')
+
+    # Opaque elements
+    types = rows['Element type']
+    names = rows['Element name']
+    if entered['Element type'].sum() != entered['Element name'].sum():
+        add('Opaque elements', 'There is a mismatch between the number of "Element type" entries '
+                               'and the assigned "Element name"')
+    for duplicate in duplicated_names(names[entered['Element name']]):
+        add('Opaque elements', f'Two or more opaque element entries are named "{duplicate}". '
+                               'All elements require a unique name.')
+    for element, area in zip(OPAQUE_ELEMENT_TYPES, OPAQUE_ELEMENT_AREAS):
+        if (types == element).sum() != entered[area].sum():
+            add('Opaque elements', f'The number of "{element}" elements does not match the number of "{area}" entries')
+    for element, required in OPAQUE_REQUIRED.items():
+        complete = entered[required].all(axis=1) & (pd.to_numeric(rows[required[0]], errors='coerce') > 0)
+        for element_name in names[(types == element) & ~complete]:
+            add('Opaque elements', f'The "{element}" element "{element_name}" is missing 1 or more required inputs')
+    unlisted = types.isin(LEVELLED_TYPES) & ~listed_levels(rows['Level of opaque element'])
+    for element_name in names[unlisted]:
+        add('Opaque elements', f'The level reference entered for "{element_name}" is not listed under "Levels"')
+
+    # Opening types
+    type_names = rows['Opening type name']
+    named_types = entered['Opening type name']
+    is_window = rows['Type'] == 'Window'
+    for inputs, rows_of_kind in ((WINDOW_INPUTS, is_window), (DOOR_INPUTS, ~is_window)):
+        incomplete = named_types & rows_of_kind & ~entered[inputs].all(axis=1)
+        for type_name in type_names[incomplete]:
+            add('Opening types', f'The opening type "{type_name}" is missing 1 or more required inputs')
+    if (~named_types & entered[WINDOW_INPUTS].any(axis=1)).any():
+        add('Opening types', 'One or more opening types have inputs but no "Opening type name"')
+    for duplicate in duplicated_names(type_names[named_types]):
+        add('Opening types', f'Two or more opening types are named "{duplicate}". All opening types require a unique name.')
+
+    # Openings
+    opening_names = rows['Opening name']
+    # Area may be left blank, Width × Height is used instead
+    areas = opening_areas(sheet)
+    opening_cells = entered[['Opening name', *OPENING_INPUTS]]
+    required = opening_cells.drop(columns='Area')
+    partial = opening_cells.any(axis=1) & ~(required.all(axis=1) & areas.iloc[1:].notna())
+    for opening_name in opening_names[partial & entered['Opening name']]:
+        add('Openings', f'The opening "{opening_name}" is missing 1 or more required inputs')
+    if (partial & ~entered['Opening name']).any():
+        add('Openings', 'One or more openings have inputs but no "Opening name"')
+    with_area = areas.iloc[1:] > 0
+    for opening_name in opening_names[with_area & ~listed_levels(rows['Opening level ref.'])]:
+        add('Openings', f'The level reference entered for opening "{opening_name}" is not listed under "Levels"')
+    wall_names = names[types.isin(WALL_TYPES)]
+    no_wall = with_area & entered['Belongs to opaque element'] & ~rows['Belongs to opaque element'].isin(wall_names)
+    for opening_name, parent in zip(opening_names[no_wall], rows['Belongs to opaque element'][no_wall]):
+        add('Openings', f'The parent element "{parent}" referred by the "{opening_name}" opening element '
+                        'does not exist or it is not an External or Sheltered wall')
+    no_type = with_area & entered['Opening type'] & ~rows['Opening type'].isin(type_names[named_types])
+    for opening_name, opening_type in zip(opening_names[no_type], rows['Opening type'][no_type]):
+        add('Openings', f'The opening type "{opening_type}" referred by the "{opening_name}" opening is not listed '
+                        'under "Opening type name"')
+
+    # Walls whose openings add up to more than their area would get a negative net area
+    walls = types.isin(WALL_TYPES)
+    wall_areas = pd.to_numeric(rows['External wall area'].where(types == 'External wall', rows['Sheltered wall area']),
+                               errors='coerce')[walls]
+    openings_areas = names[walls].map(wall_openings_areas(sheet, areas)).fillna(0.0)
+    negative = (wall_areas - openings_areas).round(3) < 0
+    for wall, gross, openings in zip(names[walls][negative], wall_areas[negative], openings_areas[negative]):
+        add('Openings', f'The openings on "{wall}" add up to {openings:g} m2, more than the {gross:g} m2 of the wall')
+
+    # Thermal bridges. The psi value sits on the first row
+    tb_block = sheet[list(TBs)]
+    psi = tb_block.iloc[0]
+    # Blank, 'ERROR' or any other text
+    for tb in psi.index[pd.to_numeric(psi, errors='coerce').isna().to_numpy()]:
+        add('Thermal bridges', f'Psi value not entered for thermal bridge {tb}')
+    # input_reader reads the lengths as numbers. Only a column holding text has cells that may not be numbers
+    for tb in tb_block.columns[(tb_block.dtypes == object).to_numpy()]:
+        lengths = tb_block[tb].iloc[1:]
+        if (pd.to_numeric(lengths, errors='coerce').isna() & lengths.notna()).any():
+            add('Thermal bridges', f'The lengths entered for thermal bridge {tb} are not all numbers')
+
+    return problems
+
+def format_problems(problems):
+    """Lists the problems as one line each, for messages and logs"""
+    return '\n'.join(f'- {problem["unit"]} / {problem["section"]}: {problem["problem"]}' for problem in problems)